@@ -0,0 +1,203 @@
+"""
+Vectorized (NumPy) attendance analytics over a whole class (or org) at once.
+"""
+
+from calendar import monthrange
+from datetime import date as dt_date, timedelta
+
+import numpy as np
+from sqlalchemy import case
+from sqlmodel import Session, func, select
+
+from models import Student, Subject
+from archive_utils import academic_year_bounds, academic_year_of, attendance_source
+from attendance_utils import subject_id_of
+from holiday_utils import count_working_days, get_calendar
+
+# Matrix cell codes; 0 means no mark for that student and day
+STATUS_CODES = ["", "P", "A", "L"]
+NOT_MARKED, PRESENT, ABSENT, LATE = range(len(STATUS_CODES))
+
+
+def month_bounds(month: str):
+    """Return (first day, last day) of a "YYYY-MM" month. Raises ValueError for a malformed month."""
+    year, month_number = map(int, month.split("-"))
+    start = dt_date(year, month_number, 1)
+    return start, start.replace(day=monthrange(year, month_number)[1])
+
+
+def get_roster(session: Session, org_code, class_name, division):
+    """An org's students of a class and division ordered by roll number."""
+    return session.exec(
+        select(Student).where(
+            Student.org_code == org_code, Student.class_name == class_name, Student.division == division
+        )
+        .order_by(Student.roll_no, Student.student_id)
+    ).all()
+
+
+def build_attendance_matrix(session: Session, org_code, class_name, division, subject, month):
+    """
+    Muster roll for one class, subject and month: a students x days array of
+    status codes (see STATUS_CODES) with per-student and per-day totals.
+    Days are the month's working days plus any other day that has marks.
+    """
+    start, end = month_bounds(month)
+    students = get_roster(session, org_code, class_name, division)
+    student_ids = np.array([s.student_id for s in students], dtype=str)
+
+    source = attendance_source(start).c
+    records = session.exec(
+        select(Student.student_id, source.date, source.status)
+        .join(Student, Student.id == source.student_pk)
+        .where(
+            source.org_code == org_code,
+            Student.class_name == class_name,
+            Student.division == division,
+            source.subject_id == subject_id_of(org_code, subject),
+            source.date >= start,
+            source.date <= end
+        )
+    ).all() if len(student_ids) else []
+
+    days = {start + timedelta(days=i) for i in range((end - start).days + 1)}
+    marked_days = {day for _, day, _ in records}
+    calendar = get_calendar(org_code, start, end, session=session)
+    dates = sorted(day for day in days if calendar.is_working_day(day) or day in marked_days)
+    ordinals = np.array([day.toordinal() for day in dates], dtype=np.int64)
+
+    matrix = np.zeros((len(student_ids), len(dates)), dtype=np.int8)
+    if records:
+        record_ids, record_days, record_statuses = zip(*records)
+        # Row / column of every record by binary search on the sorted indexes
+        order = np.argsort(student_ids)
+        rows = order[np.searchsorted(student_ids, np.array(record_ids, dtype=str), sorter=order)]
+        cols = np.searchsorted(ordinals, np.array([day.toordinal() for day in record_days], dtype=np.int64))
+        codes = np.array(record_statuses, dtype=str)
+        matrix[rows, cols] = np.select(
+            [codes == "P", codes == "A", codes == "L"], [PRESENT, ABSENT, LATE], NOT_MARKED
+        )
+
+    counts = {
+        name: (matrix == code)
+        for name, code in (("present", PRESENT), ("absent", ABSENT), ("late", LATE))
+    }
+    row_totals = {name: hits.sum(axis=1) for name, hits in counts.items()}
+    column_totals = {name: hits.sum(axis=0) for name, hits in counts.items()}
+    marked = matrix != NOT_MARKED
+    row_marked = marked.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        row_percentage = np.where(
+            row_marked > 0, (row_totals["present"] + row_totals["late"]) * 100.0 / row_marked, 0.0
+        )
+
+    return {
+        "class_name": class_name,
+        "division": division,
+        "subject": subject,
+        "month": f"{start:%Y-%m}",
+        "codes": STATUS_CODES,
+        "students": [{"student_id": s.student_id, "name": s.name, "roll_no": s.roll_no} for s in students],
+        "dates": [str(day) for day in dates],
+        "matrix": matrix.tolist(),
+        "student_totals": {
+            **{name: totals.tolist() for name, totals in row_totals.items()},
+            "marked": row_marked.tolist(),
+            "percentage": np.round(row_percentage, 1).tolist(),
+        },
+        "date_totals": {
+            **{name: totals.tolist() for name, totals in column_totals.items()},
+            "marked": marked.sum(axis=0).tolist(),
+        },
+    }
+
+
+def term_start(today):
+    """First day of the academic year containing `today`."""
+    return academic_year_bounds(academic_year_of(today))[0]
+
+
+def default_term_end(today):
+    """Last day of the academic year containing `today`."""
+    return academic_year_bounds(academic_year_of(today))[1] - timedelta(days=1)
+
+
+def project_term_end(session: Session, org_code, class_name=None, division=None, subject=None,
+                     threshold=75.0, term_end=None, today=None):
+    """
+    Best- and worst-case final percentage for every student-subject, from the
+    marks since the start of the current academic year plus one session per
+    remaining working day up to `term_end`. Late counts as present, as in
+    /defaulters. Returns (remaining working days, rows) with rows ordered
+    worst case first. Raises ValueError for a `term_end` too far ahead.
+    """
+    today = today or dt_date.today()
+    term_end = term_end or default_term_end(today)
+    remaining = (
+        count_working_days(org_code, today + timedelta(days=1), term_end, session) if term_end > today else 0
+    )
+
+    start = term_start(today)
+    source = attendance_source(start).c
+    per_student = (
+        select(
+            source.student_pk, source.subject_id,
+            func.sum(case((source.status == "P", 1), else_=0)).label("present"),
+            func.sum(case((source.status == "L", 1), else_=0)).label("late"),
+            func.count().label("total")
+        )
+        .where(source.org_code == org_code, source.date >= start, source.date <= min(today, term_end))
+        .group_by(source.student_pk, source.subject_id)
+    )
+    if subject:
+        per_student = per_student.where(source.subject_id == subject_id_of(org_code, subject))
+    per_student = per_student.subquery()
+
+    query = (
+        select(
+            Student.student_id, Student.name, Student.class_name, Student.division,
+            Student.roll_no, Subject.name.label("subject"),
+            per_student.c.present, per_student.c.late, per_student.c.total
+        )
+        .join(Student, Student.id == per_student.c.student_pk)
+        .join(Subject, Subject.id == per_student.c.subject_id)
+    )
+    if class_name:
+        query = query.where(Student.class_name == class_name)
+    if division:
+        query = query.where(Student.division == division)
+    rows = session.exec(query).all()
+    if not rows:
+        return remaining, []
+
+    attended = np.array([r.present + r.late for r in rows], dtype=np.int64)
+    total = np.array([r.total for r in rows], dtype=np.int64)
+    final_total = total + remaining
+    current = attended * 100.0 / total
+    best = (attended + remaining) * 100.0 / final_total
+    worst = attended * 100.0 / final_total
+    # Largest k with (attended + remaining - k) / final_total >= threshold
+    affordable = np.floor(attended + remaining - threshold / 100.0 * final_total + 1e-9).astype(np.int64)
+    affordable = np.clip(affordable, -1, remaining)
+    outlook = np.where(worst >= threshold, "safe", np.where(best >= threshold, "at_risk", "unrecoverable"))
+
+    order = np.lexsort((np.arange(len(rows)), worst))
+    return remaining, [
+        {
+            "student_id": rows[i].student_id,
+            "name": rows[i].name if rows[i].name is not None else "Unknown",
+            "class_name": rows[i].class_name or "",
+            "division": rows[i].division or "",
+            "roll_no": rows[i].roll_no or 0,
+            "subject": rows[i].subject,
+            "attended": int(attended[i]),
+            "total": int(total[i]),
+            "current_percentage": round(float(current[i]), 1),
+            "best_case_percentage": round(float(best[i]), 1),
+            "worst_case_percentage": round(float(worst[i]), 1),
+            # -1: below the threshold even if every remaining session is attended
+            "absences_allowed": int(affordable[i]),
+            "outlook": str(outlook[i]),
+        }
+        for i in order
+    ]
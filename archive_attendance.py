@@ -0,0 +1,27 @@
+"""
+Archive closed academic years out of the live attendance table.
+Run: python archive_attendance.py YEAR [YEAR ...]
+YEAR is the starting calendar year, e.g. 2024 for June 2024 - May 2025.
+Rows are moved to the per-year archive and dumped to archive/*.ndjson.gz.
+"""
+import sys
+from database import engine, create_db_and_tables
+from archive_utils import archive_academic_year
+
+
+def main(years):
+    create_db_and_tables()
+    for year in years:
+        try:
+            moved, path = archive_academic_year(engine, int(year))
+        except ValueError as e:
+            print(f"[Archive] Skipped {year}: {e}")
+            continue
+        print(f"[Archive] Moved {moved} attendance rows for {year}-{(int(year) + 1) % 100:02d} (dump: {path})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,252 @@
+"""
+Academic-year archival of the attendance table.
+
+Closed academic years are moved out of the live `attendance` table:
+- Postgres: into `attendance_archive`, a table natively partitioned by
+  RANGE (date) with one partition per academic year.
+- SQLite: into one `attendance_ay<year>` table per academic year, unioned
+  by the `attendance_archive` view.
+Each archived year is also dumped to a gzip-compressed NDJSON file.
+The `attendance_history` view unions live and archived rows, so queries
+that reach into archived years read it instead of `attendance`.
+"""
+
+import gzip
+import json
+import os
+import re
+import time
+from datetime import date as dt_date
+
+from sqlalchemy import Date, Integer, String, column, inspect, table, text
+
+from models import ATTENDANCE_STATUS_CODES, StatusCode
+
+# Academic years run June to May; a year is named by its starting calendar year
+ACADEMIC_YEAR_START_MONTH = 6
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_VIEW = "attendance_archive"
+HISTORY_VIEW = "attendance_history"
+YEAR_TABLE_PATTERN = re.compile(r"^attendance_ay(\d{4})$")
+
+# Columns shared by the live table and every archive
+HISTORY_COLUMN_TYPES = {
+    "id": Integer, "org_code": String, "student_pk": Integer, "subject_id": Integer,
+    "date": Date, "status": StatusCode
+}
+HISTORY_COLUMNS = list(HISTORY_COLUMN_TYPES)
+
+history_table = table(HISTORY_VIEW, *(column(name, type_) for name, type_ in HISTORY_COLUMN_TYPES.items()))
+
+# RevisionCounter row bumped by every archival run, so each process notices
+# years archived by another one (e.g. archive_attendance.py)
+ARCHIVE_COUNTER = "archive"
+
+# Seconds the cached archive state is trusted before the counter is read again
+ARCHIVE_STATE_TTL = 10
+
+# Archived academic years as of the counter value they were read at
+_UNLOADED = object()
+_archive_state = {"counter": _UNLOADED, "years": frozenset(), "until": None, "checked_at": None}
+
+
+def academic_year_of(day):
+    """Return the academic year (its starting calendar year) containing `day`."""
+    return day.year if day.month >= ACADEMIC_YEAR_START_MONTH else day.year - 1
+
+
+def academic_year_bounds(year):
+    """Return (first day, first day of the next year) for an academic year."""
+    return (dt_date(year, ACADEMIC_YEAR_START_MONTH, 1),
+            dt_date(year + 1, ACADEMIC_YEAR_START_MONTH, 1))
+
+
+def _current_archive_state():
+    """
+    The archived years and the first day after the latest of them. Served
+    from memory; at most once per ARCHIVE_STATE_TTL the archive counter is
+    read again, and the archive tables are only listed when it has moved.
+    """
+    from database import engine
+
+    checked_at = _archive_state["checked_at"]
+    if checked_at is not None and time.monotonic() - checked_at < ARCHIVE_STATE_TTL:
+        return _archive_state
+
+    with engine.connect() as conn:
+        counter = conn.execute(
+            text("SELECT value FROM revisioncounter WHERE name = :name"), {"name": ARCHIVE_COUNTER}
+        ).scalar()
+        if counter != _archive_state["counter"]:
+            years = _archived_years(conn)
+            _archive_state.update(
+                counter=counter,
+                years=frozenset(years),
+                until=academic_year_bounds(years[-1])[1] if years else None
+            )
+    _archive_state["checked_at"] = time.monotonic()
+    return _archive_state
+
+
+def invalidate_archive_state():
+    """Make the next query re-read the archive counter (after archiving in this process)."""
+    _archive_state["checked_at"] = None
+
+
+def archived_years():
+    """The academic years that have been archived."""
+    return _current_archive_state()["years"]
+
+
+def is_archived_date(day):
+    """True if `day` falls in an academic year that has been archived."""
+    return academic_year_of(day) in archived_years()
+
+
+def first_live_date():
+    """First day still held in the live attendance table (None if nothing is archived)."""
+    return _current_archive_state()["until"]
+
+
+def attendance_source(start_date=None):
+    """
+    Table to read attendance from for a query starting at `start_date`:
+    the live table, or the history view when the range reaches archived years.
+    """
+    from models import Attendance
+
+    archived_until = first_live_date()
+    if archived_until is not None and (start_date is None or start_date < archived_until):
+        return history_table
+    return Attendance.__table__
+
+
+def _archived_years(conn):
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = :parent"
+        ), {"parent": ARCHIVE_VIEW}).scalars()
+    else:
+        rows = inspect(conn).get_table_names()
+    return sorted(int(m.group(1)) for m in map(YEAR_TABLE_PATTERN.match, rows) if m)
+
+
+def ensure_history_views(conn):
+    """(Re)create the archive and history views over the live table and the archived years."""
+    columns = ", ".join(HISTORY_COLUMNS)
+    if conn.dialect.name == "postgresql":
+        # Only the history columns are archived: the live table's other
+        # columns (revision, ...) are NOT NULL and would reject the rows
+        column_defs = ", ".join(
+            f"{name} {type_().compile(dialect=conn.dialect)}" for name, type_ in HISTORY_COLUMN_TYPES.items()
+        )
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {ARCHIVE_VIEW} ({column_defs}) PARTITION BY RANGE (date)"
+        ))
+        # Archives created before attendance was tenant-scoped
+        conn.execute(text(f"ALTER TABLE {ARCHIVE_VIEW} ADD COLUMN IF NOT EXISTS org_code VARCHAR"))
+        # Archives created as a copy of the whole live table
+        extra_columns = conn.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = :table AND is_nullable = 'NO' AND NOT column_name = ANY(:columns)"
+        ), {"table": ARCHIVE_VIEW, "columns": HISTORY_COLUMNS}).scalars().all()
+        for name in extra_columns:
+            conn.execute(text(f"ALTER TABLE {ARCHIVE_VIEW} ALTER COLUMN {name} DROP NOT NULL"))
+        years = _archived_years(conn)
+        conn.execute(text(
+            f"CREATE OR REPLACE VIEW {HISTORY_VIEW} AS "
+            f"SELECT {columns} FROM attendance UNION ALL SELECT {columns} FROM {ARCHIVE_VIEW}"
+        ))
+    else:
+        years = _archived_years(conn)
+        for year in years:
+            year_columns = {c["name"] for c in inspect(conn).get_columns(f"attendance_ay{year}")}
+            if "org_code" not in year_columns:
+                conn.execute(text(f"ALTER TABLE attendance_ay{year} ADD COLUMN org_code VARCHAR"))
+        parts = [f"SELECT {columns} FROM attendance_ay{year}" for year in years]
+        archive_select = " UNION ALL ".join(parts) or f"SELECT {columns} FROM attendance WHERE 0"
+        conn.execute(text(f"DROP VIEW IF EXISTS {HISTORY_VIEW}"))
+        conn.execute(text(f"DROP VIEW IF EXISTS {ARCHIVE_VIEW}"))
+        conn.execute(text(f"CREATE VIEW {ARCHIVE_VIEW} AS {archive_select}"))
+        conn.execute(text(
+            f"CREATE VIEW {HISTORY_VIEW} AS "
+            f"SELECT {columns} FROM attendance UNION ALL SELECT {columns} FROM {ARCHIVE_VIEW}"
+        ))
+
+
+def _dump_year(conn, year, start, end, directory):
+    """
+    Write the year's live rows to <directory>/attendance_ay<year>.ndjson.gz,
+    with student_id codes, subject names and status letters so the dump
+    reads on its own.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"attendance_ay{year}.ndjson.gz")
+    rows = conn.execute(
+        text("SELECT a.id, a.org_code, s.student_id, sub.name AS subject, a.date, a.status "
+             "FROM attendance a JOIN student s ON s.id = a.student_pk JOIN subject sub ON sub.id = a.subject_id "
+             "WHERE a.date >= :start AND a.date < :end ORDER BY a.date, a.id"),
+        {"start": start, "end": end}
+    ).mappings()
+    letters = {code: letter for letter, code in ATTENDANCE_STATUS_CODES.items()}
+    count = 0
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({**row, "date": str(row["date"]), "status": letters[row["status"]]}) + "\n")
+            count += 1
+    return path, count
+
+
+def archive_academic_year(engine, year, directory=ARCHIVE_DIR, today=None):
+    """
+    Move one closed academic year out of the live attendance table.
+    Returns (rows moved, path of the compressed dump).
+    Raises ValueError if the year has not ended yet.
+    """
+    start, end = academic_year_bounds(year)
+    if end > (today or dt_date.today()):
+        raise ValueError(f"Academic year {year}-{(year + 1) % 100:02d} is not closed yet")
+
+    params = {"start": start, "end": end}
+    columns = ", ".join(HISTORY_COLUMNS)
+    year_table = f"attendance_ay{year}"
+    with engine.begin() as conn:
+        path, moved = _dump_year(conn, year, start, end, directory)
+
+        if conn.dialect.name == "postgresql":
+            ensure_history_views(conn)
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {year_table} PARTITION OF {ARCHIVE_VIEW} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            conn.execute(text(
+                f"INSERT INTO {ARCHIVE_VIEW} ({columns}) "
+                f"SELECT {columns} FROM attendance WHERE date >= :start AND date < :end"
+            ), params)
+        else:
+            if year_table in inspect(conn).get_table_names():
+                conn.execute(text(
+                    f"INSERT INTO {year_table} ({columns}) "
+                    f"SELECT {columns} FROM attendance WHERE date >= :start AND date < :end"
+                ), params)
+            else:
+                conn.execute(text(
+                    f"CREATE TABLE {year_table} AS SELECT * FROM attendance WHERE date >= :start AND date < :end"
+                ), params)
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{year_table}_student ON {year_table} (student_pk, date)"
+                ))
+
+        conn.execute(text("DELETE FROM attendance WHERE date >= :start AND date < :end"), params)
+        ensure_history_views(conn)
+        conn.execute(text(
+            "INSERT INTO revisioncounter (name, value) VALUES (:name, 1) "
+            "ON CONFLICT (name) DO UPDATE SET value = revisioncounter.value + 1"
+        ), {"name": ARCHIVE_COUNTER})
+
+    invalidate_archive_state()
+    return moved, path
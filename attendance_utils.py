@@ -0,0 +1,440 @@
+"""
+Attendance write helpers shared by the API routers.
+Bulk marks are written with a single INSERT ... ON CONFLICT DO UPDATE
+statement (SQLite and Postgres) against the (student, subject, date) key.
+Attendance stores integer student and subject keys; callers pass and get
+back student_id codes and subject names.
+Derived tables (daily rollup, per-student totals) are updated in the
+same transaction.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, case, delete, insert, literal, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select, func
+
+from models import Attendance, AttendanceDailyRollup, RevisionCounter, Student, StudentSubjectTotals, Subject
+from archive_utils import attendance_source
+from cache_utils import bump
+from event_utils import stats_broker
+
+VALID_STATUSES = ("P", "A", "L")
+
+# Rollup column holding the count for each status
+STATUS_COLUMNS = {"P": "present", "A": "absent", "L": "late"}
+
+# Keeps a single statement well under SQLite's bound-parameter limit
+UPSERT_CHUNK_SIZE = 500
+
+
+def dialect_insert(session: Session, model):
+    """Return an INSERT construct supporting ON CONFLICT for the session's database."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def attendance_counter(org_code):
+    """Name of the RevisionCounter row numbering an org's attendance writes."""
+    return f"attendance:{org_code}"
+
+
+def next_revision(session: Session, name):
+    """
+    Increment and return the named counter in one statement. The row lock
+    is held until commit, so revisions become visible in increasing order.
+    A new counter continues from the shared "attendance" counter used before
+    revisions were numbered per org, so existing sync cursors stay valid.
+    """
+    table = RevisionCounter.__table__
+    legacy = select(table.c.value).where(table.c.name == "attendance").scalar_subquery()
+    stmt = dialect_insert(session, RevisionCounter).values(name=name, value=func.coalesce(legacy, 0) + 1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"], set_={"value": table.c.value + 1}
+    ).returning(table.c.value)
+    return session.exec(stmt).one()[0]
+
+
+def get_subject_ids(session: Session, org_code, names):
+    """Return {name: Subject.id} for an org's subjects, creating the missing ones."""
+    names = set(names)
+    query = select(Subject.name, Subject.id).where(Subject.org_code == org_code)
+    ids = dict(session.exec(query.where(Subject.name.in_(names))).all())
+    missing = names - ids.keys()
+    if missing:
+        session.exec(
+            dialect_insert(session, Subject)
+            .values([{"org_code": org_code, "name": name} for name in missing])
+            .on_conflict_do_nothing(index_elements=["org_code", "name"])
+        )
+        ids.update(session.exec(query.where(Subject.name.in_(missing))).all())
+    return ids
+
+
+def subject_id_of(org_code, subject):
+    """Scalar subquery for the id of an org's subject, to filter attendance on."""
+    return select(Subject.id).where(Subject.org_code == org_code, Subject.name == subject).scalar_subquery()
+
+
+def upsert_attendance(session: Session, org_code, subject, date, marks, marked_at=None, only_newer=False,
+                      full_rows=False):
+    """
+    Insert or update attendance for many students of one org, subject and date.
+    marks: dict {student_id: status}; students not in `org_code` are skipped
+    marked_at: optional dict {student_id: naive UTC datetime} of when each
+    mark was taken (defaults to now); with only_newer=True an existing row
+    is only replaced by a strictly newer mark (last-writer-wins).
+    Returns the written rows as (student_id, status, prev_status) tuples,
+    where prev_status is None for newly inserted rows; marks that lost to a
+    newer row are not returned. With full_rows=True the written rows are
+    returned as dicts of every Attendance column, with student_id and
+    subject in place of the integer keys.
+    Does not commit; the caller owns the transaction.
+    """
+    table = Attendance.__table__
+    written = []
+    items = list(marks.items())
+    if not items:
+        return written
+
+    revision = next_revision(session, attendance_counter(org_code))
+    subject_id = get_subject_ids(session, org_code, [subject])[subject]
+    now = datetime.utcnow()
+    marked_at = marked_at or {}
+
+    for start in range(0, len(items), UPSERT_CHUNK_SIZE):
+        chunk = items[start:start + UPSERT_CHUNK_SIZE]
+        student_pks = dict(session.exec(
+            select(Student.student_id, Student.id).where(
+                Student.org_code == org_code, Student.student_id.in_([student_id for student_id, _ in chunk])
+            )
+        ).all())
+        student_ids = {pk: student_id for student_id, pk in student_pks.items()}
+        if not student_pks:
+            continue
+        stmt = dialect_insert(session, Attendance).values([
+            {"org_code": org_code, "student_pk": student_pks[student_id], "subject_id": subject_id,
+             "date": date, "status": status, "revision": revision,
+             "updated_at": marked_at.get(student_id, now)}
+            for student_id, status in chunk if student_id in student_pks
+        ])
+        # SET expressions see the old row, so prev_status captures the replaced status
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["student_pk", "subject_id", "date"],
+            set_={
+                "status": stmt.excluded.status,
+                "prev_status": table.c.status,
+                "revision": stmt.excluded.revision,
+                "updated_at": stmt.excluded.updated_at,
+            },
+            where=or_(table.c.updated_at.is_(None), table.c.updated_at < stmt.excluded.updated_at)
+            if only_newer else None,
+        )
+        if full_rows:
+            for row in session.exec(stmt.returning(*table.c)).all():
+                record = dict(row._mapping)
+                record["student_id"] = student_ids[record.pop("student_pk")]
+                record["subject"] = subject
+                del record["subject_id"]
+                written.append(record)
+        else:
+            stmt = stmt.returning(table.c.student_pk, table.c.status, table.c.prev_status)
+            written.extend(
+                (student_ids[student_pk], status, prev_status)
+                for student_pk, status, prev_status in session.exec(stmt).all()
+            )
+
+    return written
+
+
+def notify_write(org_code):
+    """Invalidate cached validators and wake live dashboards after a committed write."""
+    bump("attendance", org_code)
+    stats_broker.publish(org_code)
+
+
+def build_report_query(org_code, start_date=None, end_date=None, subject=None, class_name=None,
+                       division=None, status=None):
+    """
+    An org's attendance joined with Student, with the report filters applied
+    in SQL (org_code None, for CLI tools, reads every org). Ranges that reach
+    into archived academic years read the history view.
+    """
+    source = attendance_source(start_date).c
+    query = (
+        select(
+            source.id, Student.student_id, Student.name, Student.roll_no,
+            Student.class_name, Student.division, Subject.name.label("subject"),
+            source.date, source.status
+        )
+        .join(Student, Student.id == source.student_pk)
+        .join(Subject, Subject.id == source.subject_id)
+    )
+
+    if org_code:
+        query = query.where(source.org_code == org_code)
+
+    if start_date:
+        query = query.where(source.date >= start_date)
+    if end_date:
+        query = query.where(source.date <= end_date)
+    if subject:
+        query = query.where(Subject.name == subject)
+    if status:
+        query = query.where(source.status == status)
+    if class_name:
+        query = query.where(Student.class_name == class_name)
+    if division:
+        query = query.where(Student.division == division)
+    return query
+
+
+def build_class_summary_query(org_code, start_date=None, end_date=None, threshold=75.0, subject=None,
+                              class_name=None, division=None):
+    """
+    One row per class, division and subject: sessions held, students marked,
+    the mean of their attendance percentages (late counts as present) and
+    how many are below `threshold`, in a single statement.
+    Without a date range per-student counts come from the running totals;
+    with one they are a GROUP BY over the raw rows, read through the covering
+    ix_attendance_org_date_summary index (or the history view for archived
+    years). Sessions are the days with marks in the daily rollup, counted
+    along ix_rollup_org_class_subject_date.
+    """
+    rollup = AttendanceDailyRollup
+    # One rollup row per class, subject and marked day
+    sessions = select(
+        rollup.class_name, rollup.division, rollup.subject, func.count().label("sessions")
+    ).where(rollup.org_code == org_code)
+
+    from_totals = start_date is None and end_date is None
+    if from_totals:
+        totals = StudentSubjectTotals
+        per_student = select(
+            totals.student_id, totals.subject, (totals.present + totals.late).label("attended"), totals.total
+        ).where(totals.total > 0)
+        if subject:
+            per_student = per_student.where(totals.subject == subject)
+    else:
+        source = attendance_source(start_date).c
+        per_student = (
+            select(
+                source.student_pk, source.subject_id,
+                func.sum(case((source.status.in_(("P", "L")), 1), else_=0)).label("attended"),
+                func.count().label("total")
+            )
+            .where(source.org_code == org_code)
+            .group_by(source.student_pk, source.subject_id)
+        )
+        if start_date:
+            per_student = per_student.where(source.date >= start_date)
+            sessions = sessions.where(rollup.date >= start_date)
+        if end_date:
+            per_student = per_student.where(source.date <= end_date)
+            sessions = sessions.where(rollup.date <= end_date)
+        if subject:
+            per_student = per_student.where(source.subject_id == subject_id_of(org_code, subject))
+        if class_name or division:
+            roster = select(Student.id).where(Student.org_code == org_code)
+            if class_name:
+                roster = roster.where(Student.class_name == class_name)
+            if division:
+                roster = roster.where(Student.division == division)
+            per_student = per_student.where(source.student_pk.in_(roster))
+
+    if subject:
+        sessions = sessions.where(rollup.subject == subject)
+    if class_name:
+        sessions = sessions.where(rollup.class_name == class_name)
+    if division:
+        sessions = sessions.where(rollup.division == division)
+    per_student = per_student.subquery("per_student")
+    sessions = sessions.group_by(rollup.class_name, rollup.division, rollup.subject).subquery("sessions")
+
+    # Grouped rows are joined to Student (and Subject), not every mark
+    if from_totals:
+        subject_name = per_student.c.subject
+        marked = per_student.join(Student, Student.student_id == per_student.c.student_id)
+    else:
+        subject_name = Subject.name
+        marked = (
+            per_student.join(Student, Student.id == per_student.c.student_pk)
+            .join(Subject, Subject.id == per_student.c.subject_id)
+        )
+    percentage = per_student.c.attended * 100.0 / per_student.c.total
+    group = (Student.class_name, Student.division, subject_name)
+    query = (
+        select(
+            Student.class_name, Student.division, subject_name.label("subject"),
+            func.coalesce(sessions.c.sessions, 0).label("sessions"),
+            func.count().label("students"),
+            func.avg(percentage).label("average_percentage"),
+            func.sum(case((percentage < threshold, 1), else_=0)).label("below_threshold")
+        )
+        .select_from(marked)
+        .outerjoin(sessions, and_(
+            sessions.c.class_name == Student.class_name,
+            sessions.c.division == Student.division,
+            sessions.c.subject == subject_name
+        ))
+        .where(Student.org_code == org_code)
+        .group_by(*group, sessions.c.sessions)
+        .order_by(*group)
+    )
+    if class_name:
+        query = query.where(Student.class_name == class_name)
+    if division:
+        query = query.where(Student.division == division)
+    return query
+
+
+def get_student_classes(session: Session, student_ids, org_code=None):
+    """
+    Return {student_id: (class_name, division)} for the given IDs in one query.
+    With `org_code`, students of other orgs are left out.
+    """
+    if not student_ids:
+        return {}
+    query = (
+        select(Student.student_id, Student.class_name, Student.division)
+        .where(Student.student_id.in_(list(student_ids)))
+    )
+    if org_code:
+        query = query.where(Student.org_code == org_code)
+    rows = session.exec(query).all()
+    return {student_id: (class_name, division) for student_id, class_name, division in rows}
+
+
+def update_daily_rollup(session: Session, org_code, subject, date, written, student_classes):
+    """
+    Apply the status changes in `written` ((student_id, status, prev_status)
+    tuples) to the daily rollup rows of their class and division.
+    Students missing from `student_classes` are skipped, matching the rebuild.
+    Does not commit; the caller owns the transaction.
+    """
+    deltas = defaultdict(lambda: {"present": 0, "absent": 0, "late": 0})
+    for student_id, status, prev_status in written:
+        if student_id not in student_classes or status == prev_status:
+            continue
+        delta = deltas[student_classes[student_id]]
+        if status in STATUS_COLUMNS:
+            delta[STATUS_COLUMNS[status]] += 1
+        if prev_status in STATUS_COLUMNS:
+            delta[STATUS_COLUMNS[prev_status]] -= 1
+
+    rows = [
+        {"org_code": org_code, "date": date, "class_name": class_name,
+         "division": division, "subject": subject, **delta}
+        for (class_name, division), delta in deltas.items()
+        if any(delta.values())
+    ]
+    if not rows:
+        return
+
+    table = AttendanceDailyRollup.__table__
+    stmt = dialect_insert(session, AttendanceDailyRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["org_code", "date", "class_name", "division", "subject"],
+        set_={column: table.c[column] + stmt.excluded[column] for column in STATUS_COLUMNS.values()},
+    )
+    session.exec(stmt)
+
+
+def update_student_totals(session: Session, subject, date, written):
+    """
+    Apply the status changes in `written` ((student_id, status, prev_status)
+    tuples) to the per-student running totals for `subject`.
+    A changed status (e.g. P to A) moves one count; only inserts grow `total`.
+    Does not commit; the caller owns the transaction.
+    """
+    rows = []
+    for student_id, status, prev_status in written:
+        if status == prev_status:
+            continue
+        row = {"student_id": student_id, "subject": subject, "last_date": date,
+               "present": 0, "absent": 0, "late": 0, "total": 0 if prev_status else 1}
+        if status in STATUS_COLUMNS:
+            row[STATUS_COLUMNS[status]] += 1
+        if prev_status in STATUS_COLUMNS:
+            row[STATUS_COLUMNS[prev_status]] -= 1
+        rows.append(row)
+    if not rows:
+        return
+
+    table = StudentSubjectTotals.__table__
+    stmt = dialect_insert(session, StudentSubjectTotals).values(rows)
+    counters = [*STATUS_COLUMNS.values(), "total"]
+    set_ = {column: table.c[column] + stmt.excluded[column] for column in counters}
+    set_["last_date"] = case(
+        (or_(table.c.last_date.is_(None), stmt.excluded.last_date > table.c.last_date),
+         stmt.excluded.last_date),
+        else_=table.c.last_date,
+    )
+    session.exec(stmt.on_conflict_do_update(index_elements=["student_id", "subject"], set_=set_))
+
+
+def rebuild_daily_rollup(session: Session, org_code):
+    """
+    Regenerate the daily rollup for `org_code` from its raw attendance rows,
+    archived academic years included. Commits and returns the number of
+    rollup rows.
+    """
+    session.exec(delete(AttendanceDailyRollup).where(AttendanceDailyRollup.org_code == org_code))
+
+    source = attendance_source().c
+    counts = [
+        func.sum(case((source.status == status, 1), else_=0))
+        for status in STATUS_COLUMNS
+    ]
+    aggregate = (
+        select(
+            literal(org_code), source.date, Student.class_name, Student.division,
+            Subject.name, *counts
+        )
+        .join(Student, Student.id == source.student_pk)
+        .join(Subject, Subject.id == source.subject_id)
+        .where(source.org_code == org_code)
+        .group_by(source.date, Student.class_name, Student.division, Subject.name)
+    )
+    session.exec(insert(AttendanceDailyRollup).from_select(
+        ["org_code", "date", "class_name", "division", "subject", *STATUS_COLUMNS.values()],
+        aggregate,
+    ))
+    session.commit()
+
+    return session.exec(
+        select(func.count(AttendanceDailyRollup.id)).where(AttendanceDailyRollup.org_code == org_code)
+    ).one()
+
+
+def rebuild_student_totals(session: Session):
+    """
+    Regenerate the per-student running totals from raw attendance rows,
+    archived academic years included. Commits and returns the number of
+    totals rows.
+    """
+    session.exec(delete(StudentSubjectTotals))
+
+    source = attendance_source().c
+    counts = [
+        func.sum(case((source.status == status, 1), else_=0))
+        for status in STATUS_COLUMNS
+    ]
+    aggregate = (
+        select(
+            Student.student_id, Subject.name, *counts,
+            func.count(source.id), func.max(source.date)
+        )
+        .join(Student, Student.id == source.student_pk)
+        .join(Subject, Subject.id == source.subject_id)
+        .group_by(Student.student_id, Subject.name)
+    )
+    session.exec(insert(StudentSubjectTotals).from_select(
+        ["student_id", "subject", *STATUS_COLUMNS.values(), "total", "last_date"],
+        aggregate,
+    ))
+    session.commit()
+
+    return session.exec(select(func.count(StudentSubjectTotals.id))).one()
@@ -0,0 +1,85 @@
+"""
+Concurrent-request throughput benchmark for the read API.
+
+Logs in, then fires requests at a few dashboard endpoints with increasing
+numbers of concurrent clients and prints requests/second and latency
+percentiles. Run it against a server before and after a change:
+
+    uvicorn main:app --port 8000 > /dev/null
+    python benchmark_async.py --base-url http://127.0.0.1:8000
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+DEFAULT_PATHS = ["/attendance/stats", "/attendance/weekly?days=30", "/students/", "/users/me"]
+DEFAULT_CONCURRENCY = [1, 10, 50, 100]
+
+
+async def login(client, org_code, username, password):
+    response = await client.post(
+        "/token", data={"org_code": org_code, "username": username, "password": password}
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_level(client, headers, paths, concurrency, total):
+    """Send `total` requests with `concurrency` clients; return (elapsed, latencies, errors)."""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await client.get(paths[i % len(paths)], headers=headers)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        token = await login(client, args.org_code, args.username, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # Warm up connection pools on both ends
+        await run_level(client, headers, args.paths, 10, 50)
+
+        print(f"{'clients':>8} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+        for concurrency in args.concurrency:
+            total = max(args.requests, concurrency * 5)
+            elapsed, latencies, errors = await run_level(client, headers, args.paths, concurrency, total)
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"{concurrency:>8} {total:>9} {total / elapsed:>9.1f} {p50:>8.1f} {p95:>8.1f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent-request throughput benchmark")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--org-code", default="SCH-DEMOIN-ABC123")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    asyncio.run(main(parser.parse_args()))
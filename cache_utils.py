@@ -0,0 +1,72 @@
+"""
+Conditional GET support (ETag / Last-Modified) for polled read endpoints.
+
+Each (namespace, org) pair has an in-memory version that write endpoints
+bump after they commit. Validators are built from those versions plus the
+request's own parameters, so a matching If-None-Match is answered with 304
+before any data query runs. Versions live in this process: the app runs as
+a single uvicorn worker (--workers 1 in Procfile / render.yaml), and a
+restart starts a new version sequence.
+"""
+
+import hashlib
+import itertools
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from threading import Lock
+
+from fastapi import Request, Response
+
+_started = datetime.now(timezone.utc).replace(microsecond=0)
+# Seeded from the clock so ETags from a previous process never match
+_counter = itertools.count(int(time.time() * 1000))
+_versions = {}
+_lock = Lock()
+
+
+def bump(namespace, org_code):
+    """Record a committed write to `namespace` ("attendance", "students", "holidays", ...) for an org."""
+    with _lock:
+        _versions[(namespace, org_code)] = (
+            next(_counter), datetime.now(timezone.utc).replace(microsecond=0)
+        )
+
+
+def validators(namespaces, org_code, *scope):
+    """Return (etag, last_modified) for data drawn from `namespaces`, narrowed by `scope`."""
+    with _lock:
+        states = [_versions.get((namespace, org_code), (0, _started)) for namespace in namespaces]
+    key = "|".join([org_code or "", *namespaces, *map(str, scope), *(str(v) for v, _ in states)])
+    etag = 'W/"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+    last_modified = max(modified for _, modified in states)
+    return etag, last_modified
+
+
+def check_not_modified(request: Request, response: Response, namespaces, org_code, *scope):
+    """
+    Set ETag / Last-Modified on `response`, and return a 304 Response if the
+    client's copy is still current (the caller should return it as-is).
+    """
+    etag, last_modified = validators(namespaces, org_code, *scope)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                if last_modified <= parsedate_to_datetime(if_modified_since):
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass  # Unparseable date: ignore, as RFC 9110 asks
+
+    response.headers.update(headers)
+    return None
@@ -1,4 +1,6 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 import os
 
 # Default to SQLite with ABSOLUTE path to avoid CWD ambiguity
@@ -11,9 +13,20 @@ DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Async driver for the same database: aiosqlite for SQLite, asyncpg for Postgres
+def _async_database_url(url):
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_database_url(DATABASE_URL))
+
 # Create engine
 # echo=True prints SQL queries to console (useful for debugging)
 engine = create_engine(DATABASE_URL, echo=True)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=True)
 
 def create_db_and_tables():
     """Create all tables defined in SQLModel metadata."""
@@ -23,3 +36,11 @@ def get_session():
     """Dependency to provide a database session."""
     with Session(engine) as session:
         yield session
+
+async def get_async_session():
+    """
+    Dependency to provide an async database session for `async def` routes.
+    Sync helpers can be reused with `await session.run_sync(helper, ...)`.
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
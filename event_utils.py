@@ -0,0 +1,64 @@
+"""
+In-process publish/subscribe for live dashboard updates.
+
+Writers call `stats_broker.publish(org_code)` after committing (from any
+thread). Each subscriber owns a single "dirty" flag, so any number of
+publishes between two reads coalesce into one notification.
+"""
+
+import asyncio
+from collections import defaultdict
+from threading import Lock
+
+
+class Subscription:
+    """One listener; `wait()` returns once something was published since the last wait."""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def _notify(self):
+        # Called from writer threads; asyncio.Event is not thread-safe
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # Loop already closed; the subscriber is gone
+
+    async def wait(self, timeout=None):
+        """Return True when notified, False on timeout."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+class Broker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = Lock()
+
+    def subscribe(self, topic):
+        """Register a listener for `topic`; must be called from the event loop."""
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, topic, subscription):
+        with self._lock:
+            self._subscribers[topic].discard(subscription)
+            if not self._subscribers[topic]:
+                del self._subscribers[topic]
+
+    def publish(self, topic):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(topic, ()))
+        for subscription in subscriptions:
+            subscription._notify()
+
+
+# Topic: org_code; published whenever that org's attendance changes
+stats_broker = Broker()
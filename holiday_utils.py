@@ -0,0 +1,214 @@
+"""
+Working-day calendar per organization, built from the Holiday table.
+
+Holidays without an org_code apply to every organization (the national
+list, seeded from data/holidays.json); an org's own rows are added to them.
+Saturdays and Sundays are never working days.
+
+An org's calendar spans whole calendar years as a working-day bitset (one
+byte per day) with prefix sums over it, so is_working_day,
+count_working_days and add_working_days are a few array lookups. Years are
+loaded on first use and the calendar is dropped when holidays change
+(invalidate()).
+"""
+
+import json
+from array import array
+from datetime import date as dt_date, datetime, timedelta
+from threading import Lock
+
+from sqlalchemy import inspect, or_, text
+from sqlmodel import Session, select
+
+from database import engine
+from models import Holiday
+from attendance_utils import dialect_insert
+
+HOLIDAYS_FILE = "data/holidays.json"
+HOLIDAYS_FILE_DATE_FORMAT = "%d-%m-%Y"
+WEEKEND_DAYS = (5, 6)  # Saturday, Sunday
+
+# Upper bound on the years one calendar spans, against absurd date ranges
+MAX_SPAN_YEARS = 50
+
+_calendars = {}
+_lock = Lock()
+
+
+class WorkingDayCalendar:
+    """Working days of one org over the calendar years first_year..last_year."""
+
+    def __init__(self, first_year, last_year, holidays):
+        self.first_year, self.last_year = first_year, last_year
+        self.holidays = holidays  # {date: name}
+        self._origin = dt_date(first_year, 1, 1).toordinal()
+        days = dt_date(last_year, 12, 31).toordinal() - self._origin + 1
+
+        first_weekday = dt_date(first_year, 1, 1).weekday()
+        holiday_offsets = {day.toordinal() - self._origin for day in holidays}
+        self._bits = bytearray(
+            (first_weekday + i) % 7 not in WEEKEND_DAYS and i not in holiday_offsets
+            for i in range(days)
+        )
+        # _prefix[i]: working days before offset i; _working: offsets of the working days
+        self._prefix = array("l", [0]) * (days + 1)
+        self._working = array("l")
+        for i, working in enumerate(self._bits):
+            self._prefix[i + 1] = self._prefix[i] + working
+            if working:
+                self._working.append(i)
+
+    def covers(self, day):
+        return self.first_year <= day.year <= self.last_year
+
+    def _offset(self, day):
+        if not self.covers(day):
+            raise ValueError(f"{day} is outside the loaded calendar")
+        return day.toordinal() - self._origin
+
+    def is_working_day(self, day):
+        return bool(self._bits[self._offset(day)])
+
+    def count_working_days(self, start, end):
+        """Working days in [start, end]."""
+        if end < start:
+            return 0
+        return self._prefix[self._offset(end) + 1] - self._prefix[self._offset(start)]
+
+    def add_working_days(self, day, n):
+        """The n-th working day after `day` (n >= 1), or None past the loaded years."""
+        index = self._prefix[self._offset(day) + 1] + n - 1
+        if index >= len(self._working):
+            return None
+        return dt_date.fromordinal(self._origin + self._working[index])
+
+
+def _load_holidays(session: Session, org_code, first_year, last_year):
+    return dict(session.exec(
+        select(Holiday.date, Holiday.name).where(
+            or_(Holiday.org_code == org_code, Holiday.org_code.is_(None)),
+            Holiday.date >= dt_date(first_year, 1, 1),
+            Holiday.date <= dt_date(last_year, 12, 31)
+        )
+    ).all())
+
+
+def get_calendar(org_code, *days, session: Session = None):
+    """
+    The calendar of `org_code`, loaded to cover every date in `days`.
+    Reads through `session` when given, else its own connection.
+    """
+    with _lock:
+        calendar = _calendars.get(org_code)
+    if calendar and all(calendar.covers(day) for day in days):
+        return calendar
+
+    years = {day.year for day in days}
+    if max(years) - min(years) >= MAX_SPAN_YEARS:
+        raise ValueError(f"Date range spans more than {MAX_SPAN_YEARS} years")
+    if calendar and max(calendar.last_year, *years) - min(calendar.first_year, *years) < MAX_SPAN_YEARS:
+        years.update((calendar.first_year, calendar.last_year))
+    first_year, last_year = min(years), max(years)
+
+    if session is None:
+        with Session(engine) as own_session:
+            holidays = _load_holidays(own_session, org_code, first_year, last_year)
+    else:
+        holidays = _load_holidays(session, org_code, first_year, last_year)
+    calendar = WorkingDayCalendar(first_year, last_year, holidays)
+    with _lock:
+        _calendars[org_code] = calendar
+    return calendar
+
+
+def is_working_day(org_code, day, session: Session = None):
+    return get_calendar(org_code, day, session=session).is_working_day(day)
+
+
+def count_working_days(org_code, start, end, session: Session = None):
+    """Working days of `org_code` in [start, end]."""
+    return get_calendar(org_code, start, end, session=session).count_working_days(start, end)
+
+
+def add_working_days(org_code, day, n, session: Session = None):
+    """The n-th working day of `org_code` after `day` (n >= 1)."""
+    # n working days fit in 2n + 14 calendar days unless most weekdays are holidays
+    calendar = get_calendar(org_code, day, day + timedelta(days=2 * n + 14), session=session)
+    result = calendar.add_working_days(day, n)
+    if result is None:
+        raise ValueError(f"Fewer than {n} working days after {day} in {calendar.last_year}")
+    return result
+
+
+def invalidate(org_code=None):
+    """Drop cached calendars after holidays change (all orgs for org-less holidays)."""
+    with _lock:
+        if org_code is None:
+            _calendars.clear()
+        else:
+            _calendars.pop(org_code, None)
+
+
+def ensure_holiday_columns(conn):
+    """
+    Give holiday tables created before org-scoped holidays an org_code
+    column, and drop duplicate shared holidays before their unique index.
+    """
+    if "org_code" not in {c["name"] for c in inspect(conn).get_columns("holiday")}:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE holiday ADD COLUMN org_code VARCHAR"))
+            conn.execute(text("ALTER TABLE holiday DROP CONSTRAINT IF EXISTS holiday_date_key"))
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_holiday_org_date ON holiday (org_code, date)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_holiday_date ON holiday (date)"))
+        else:
+            # SQLite cannot drop the old UNIQUE (date) constraint; copy into a new table
+            conn.execute(text("ALTER TABLE holiday RENAME TO holiday_old"))
+            Holiday.__table__.create(conn)
+            conn.execute(text(
+                "INSERT INTO holiday (id, date, name, holiday_type) "
+                "SELECT id, date, name, holiday_type FROM holiday_old"
+            ))
+            conn.execute(text("DROP TABLE holiday_old"))
+        print("[Calendar] Added org_code column to holiday")
+
+    if "uq_holiday_shared_date" not in {index["name"] for index in inspect(conn).get_indexes("holiday")}:
+        removed = conn.execute(text(
+            "DELETE FROM holiday WHERE org_code IS NULL AND id NOT IN "
+            "(SELECT MIN(id) FROM holiday WHERE org_code IS NULL GROUP BY date)"
+        )).rowcount
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_holiday_shared_date ON holiday (date) WHERE org_code IS NULL"
+        ))
+        if removed:
+            print(f"[Calendar] Removed {removed} duplicate shared holidays")
+
+
+def seed_holidays_from_file(path=HOLIDAYS_FILE):
+    """Load the shared holiday list from `path` into an empty Holiday table (called on startup)."""
+    with Session(engine) as session:
+        if session.exec(select(Holiday.id).where(Holiday.org_code.is_(None))).first():
+            return 0
+        try:
+            with open(path, "r") as f:
+                entries = json.load(f).get("holidays", [])
+        except FileNotFoundError:
+            print(f"[Calendar] Warning: {path} not found. No shared holidays loaded.")
+            return 0
+        if not entries:
+            return 0
+        # Another process may be seeding at the same time; its rows win
+        seeded = session.exec(
+            dialect_insert(session, Holiday)
+            .values([
+                {
+                    "date": datetime.strptime(entry["date"], HOLIDAYS_FILE_DATE_FORMAT).date(),
+                    "name": entry["name"],
+                    "holiday_type": entry.get("type", "gazetted")
+                }
+                for entry in entries
+            ])
+            .on_conflict_do_nothing(index_elements=["date"], index_where=Holiday.org_code.is_(None))
+        ).rowcount
+        session.commit()
+    print(f"[Calendar] Seeded {seeded} shared holidays from {path}")
+    return seeded
@@ -0,0 +1,86 @@
+"""
+Idempotency-Key support for attendance write endpoints.
+The first request with a key stores its response in the same transaction
+as the write; retries with the same key and body get that response back
+without touching the Attendance table. Keys expire after IDEMPOTENCY_TTL.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from models import IdempotencyKey
+from attendance_utils import dialect_insert
+
+IDEMPOTENCY_TTL = timedelta(hours=24)
+
+# Expired keys are purged at most this often (piggybacking on writes)
+CLEANUP_INTERVAL = timedelta(minutes=10)
+_last_cleanup = datetime.min
+
+
+def hash_payload(payload) -> str:
+    """Stable SHA-256 of a JSON-serialisable payload."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def find_replay(session: Session, org_code, endpoint, key, request_hash):
+    """
+    Return a JSONResponse replaying the stored result for `key`, or None.
+    Raises 422 if the key was already used with a different request body.
+    """
+    stored = session.exec(
+        select(IdempotencyKey).where(
+            IdempotencyKey.org_code == org_code,
+            IdempotencyKey.endpoint == endpoint,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at > datetime.utcnow()
+        )
+    ).first()
+    if not stored:
+        return None
+    if stored.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return JSONResponse(
+        content=json.loads(stored.response_body),
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+def store_result(session: Session, org_code, endpoint, key, request_hash, response):
+    """
+    Record `response` for `key` inside the caller's transaction.
+    A concurrent request that stored the same key first wins.
+    """
+    global _last_cleanup
+
+    now = datetime.utcnow()
+    body = json.dumps(response, sort_keys=True, default=str)
+    table = IdempotencyKey.__table__
+
+    # An expired row with the same key would block the insert, so purge first
+    session.exec(delete(IdempotencyKey).where(
+        IdempotencyKey.org_code == org_code,
+        IdempotencyKey.endpoint == endpoint,
+        IdempotencyKey.key == key,
+        IdempotencyKey.expires_at <= now
+    ))
+    session.exec(dialect_insert(session, IdempotencyKey).values(
+        org_code=org_code,
+        endpoint=endpoint,
+        key=key,
+        request_hash=request_hash,
+        response_hash=hashlib.sha256(body.encode()).hexdigest(),
+        response_body=body,
+        created_at=now,
+        expires_at=now + IDEMPOTENCY_TTL
+    ).on_conflict_do_nothing(index_elements=[table.c.org_code, table.c.endpoint, table.c.key]))
+
+    if now - _last_cleanup >= CLEANUP_INTERVAL:
+        session.exec(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+        _last_cleanup = now
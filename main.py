@@ -1,9 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from database import create_db_and_tables
-from routers import auth, attendance, students
+from database import create_db_and_tables, engine
+from routers import auth, attendance, calendar, rollcall, students
 from auto_setup import auto_setup_default_account
+from rebuild_rollups import rebuild_if_empty
+from migrate_tenant_scope import backfill_org_codes, ensure_tenant_columns
+from archive_utils import ensure_history_views
+from holiday_utils import ensure_holiday_columns, seed_holidays_from_file
+import write_behind_utils
 import os
 from dotenv import load_dotenv
 
@@ -40,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "Content-Disposition"],
 )
 
 @app.on_event("startup")
@@ -68,6 +74,11 @@ def on_startup():
             print("[AutoMigrate] Added status column to attendance")
         except Exception:
             pass  # Already exists
+        # Date index backs the per-day dashboard aggregates
+        try:
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_attendance_date ON attendance (date)")
+        except Exception:
+            pass
         conn.commit()
         conn.close()
         print("[AutoMigrate] Schema check complete.")
@@ -77,6 +88,51 @@ def on_startup():
     # Auto-create default admin account if database is empty
     auto_setup_default_account()
 
+    # Per-org columns and indexes on student / attendance, on integer keys
+    # (see migrate_tenant_scope.py and migrate_compact_attendance.py).
+    # Not optional: the models only match the converted table
+    try:
+        with engine.begin() as conn:
+            ensure_tenant_columns(conn)
+    except Exception as e:
+        print("[Tenant] Error: attendance schema migration failed: " + str(e))
+        raise
+
+    # Org-scoped holidays; the shared list is seeded from data/holidays.json
+    try:
+        with engine.begin() as conn:
+            ensure_holiday_columns(conn)
+        seed_holidays_from_file()
+    except Exception as e:
+        print("[Calendar] Warning: " + str(e))
+
+    # Views over live + archived attendance (see archive_attendance.py)
+    try:
+        with engine.begin() as conn:
+            ensure_history_views(conn)
+    except Exception as e:
+        print("[Archive] Warning: " + str(e))
+
+    # Tag rows created before tenant scoping with their org
+    try:
+        backfill_org_codes()
+    except Exception as e:
+        print("[Tenant] Warning: " + str(e))
+
+    # Populate the dashboard rollup for databases created before it existed
+    try:
+        rebuild_if_empty()
+    except Exception as e:
+        print("[Rollup] Warning: " + str(e))
+
+    # Optional queued single-record marks (ATTENDANCE_WRITE_BEHIND=1)
+    if write_behind_utils.ENABLED:
+        write_behind_utils.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    write_behind_utils.stop()
+
 
 
 @app.get("/")
@@ -86,3 +142,5 @@ def read_root():
 app.include_router(auth.router)
 app.include_router(students.router, prefix="/students", tags=["students"])
 app.include_router(attendance.router, prefix="/attendance", tags=["attendance"])
+app.include_router(rollcall.router, prefix="/attendance", tags=["attendance"])
+app.include_router(calendar.router, prefix="/calendar", tags=["calendar"])
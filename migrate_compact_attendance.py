@@ -0,0 +1,215 @@
+"""
+Migration: store attendance with integer keys and a coded status.
+Run: python migrate_compact_attendance.py
+
+Attendance rows used to repeat the student's code ("FYBCAA001") and the
+subject name as strings, with a free-text status. This converts the live
+table and every archived academic year to:
+- student_pk: the student's Student.id
+- subject_id: a row of the per-org Subject table, created from the names
+- status / prev_status: 1 / 2 / 3 for P / A / L as a SMALLINT with a CHECK
+Rows that cannot be keyed (their student no longer exists, or the status
+is not P, A or L) are moved to <table>_unmatched and reported.
+The rollup, totals and streak tables keep codes and names and are unchanged.
+Safe to run more than once; the app also runs it on startup.
+"""
+import sys
+from sqlalchemy import PrimaryKeyConstraint, inspect, text
+from sqlalchemy.schema import AddConstraint
+
+from database import engine, create_db_and_tables
+from models import ATTENDANCE_STATUS_CODES, Attendance
+from archive_utils import ARCHIVE_VIEW, HISTORY_VIEW, YEAR_TABLE_PATTERN, ensure_history_views
+
+
+# Live-table columns added after the first release, which the conversion
+# reads: the status, upsert bookkeeping, the change-feed revision and the
+# last-writer-wins timestamp
+LIVE_COLUMNS = {
+    "status": "VARCHAR NOT NULL DEFAULT 'P'",
+    "prev_status": "VARCHAR",
+    "revision": "INTEGER NOT NULL DEFAULT 0",
+    "updated_at": "TIMESTAMP",
+}
+
+
+def _status_code(column):
+    """SQL for the status code of a letter column (NULL for anything else)."""
+    cases = " ".join(f"WHEN '{letter}' THEN {code}" for letter, code in ATTENDANCE_STATUS_CODES.items())
+    return f"CASE {column} {cases} END"
+
+
+def _columns(conn, table_name):
+    return {c["name"] for c in inspect(conn).get_columns(table_name)}
+
+
+def _legacy_tables(conn):
+    """The attendance tables (live first, then archives) still keyed by strings."""
+    if conn.dialect.name == "postgresql":
+        archives = [ARCHIVE_VIEW] if inspect(conn).has_table(ARCHIVE_VIEW) else []
+    else:
+        archives = sorted(name for name in inspect(conn).get_table_names() if YEAR_TABLE_PATTERN.match(name))
+    return [name for name in ("attendance", *archives) if "student_id" in _columns(conn, name)]
+
+
+def _org_of(conn, table_name):
+    """SQL for a legacy row's org: its own org_code, else its student's."""
+    return "COALESCE(a.org_code, s.org_code)" if "org_code" in _columns(conn, table_name) else "s.org_code"
+
+
+def _prepare_live_table(conn):
+    """
+    Bring a string-keyed live table up to the columns the conversion copies
+    and drop duplicate marks (keeping the latest), so the one-mark-per-key
+    unique constraint can be added.
+    """
+    columns = _columns(conn, "attendance")
+    for name, definition in LIVE_COLUMNS.items():
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE attendance ADD COLUMN {name} {definition}"))
+            print(f"[Compact] Added {name} column to attendance")
+    removed = conn.execute(text(
+        "DELETE FROM attendance WHERE id NOT IN "
+        "(SELECT MAX(id) FROM attendance GROUP BY student_id, subject, date)"
+    )).rowcount
+    if removed:
+        print(f"[Compact] Removed {removed} duplicate attendance rows")
+
+
+def _create_subjects(conn, tables):
+    """Add a Subject row for every (org, subject name) of the tables' keyable rows."""
+    names = " UNION ".join(
+        f"SELECT {_org_of(conn, name)} AS org_code, a.subject AS name "
+        f"FROM {name} a JOIN student s ON s.student_id = a.student_id"
+        for name in tables
+    )
+    conn.execute(text(
+        f"INSERT INTO subject (org_code, name) SELECT DISTINCT t.org_code, t.name FROM ({names}) t "
+        "WHERE NOT EXISTS (SELECT 1 FROM subject WHERE subject.name = t.name AND "
+        "(subject.org_code = t.org_code OR (subject.org_code IS NULL AND t.org_code IS NULL)))"
+    ))
+
+
+def _compact_sqlite(conn, table_name):
+    """
+    SQLite cannot change column types: copy the table into one with the new
+    shape (the model's for the live table). Returns (rows kept, rows unmatched).
+    """
+    columns = _columns(conn, table_name)
+    org = _org_of(conn, table_name)
+    legacy = f"{table_name}_legacy"
+    for index in inspect(conn).get_indexes(table_name):
+        conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {legacy}"))
+    if table_name == "attendance":
+        Attendance.__table__.create(conn)
+    else:
+        conn.execute(text(f"CREATE TABLE {table_name} AS SELECT * FROM attendance WHERE 0"))
+        conn.execute(text(f"CREATE INDEX ix_{table_name}_student ON {table_name} (student_pk, date)"))
+
+    copied = {"prev_status": _status_code("a.prev_status")}
+    copied.update({name: f"a.{name}" for name in ("revision", "updated_at")})
+    copied = {name: value for name, value in copied.items() if name in columns}
+    kept = conn.execute(text(
+        f"INSERT INTO {table_name} (id, org_code, student_pk, subject_id, date, status"
+        f"{''.join(', ' + name for name in copied)}) "
+        f"SELECT a.id, {org}, s.id, sub.id, a.date, {_status_code('a.status')}"
+        f"{''.join(', ' + value for value in copied.values())} "
+        f"FROM {legacy} a JOIN student s ON s.student_id = a.student_id "
+        f"JOIN subject sub ON sub.name = a.subject AND sub.org_code IS {org} "
+        f"WHERE a.status IN ('P', 'A', 'L')"
+    )).rowcount
+
+    unmatched = conn.execute(text(f"SELECT COUNT(*) FROM {legacy}")).scalar() - kept
+    if unmatched:
+        conn.execute(text(
+            f"CREATE TABLE {table_name}_unmatched AS "
+            f"SELECT * FROM {legacy} WHERE id NOT IN (SELECT id FROM {table_name})"
+        ))
+    conn.execute(text(f"DROP TABLE {legacy}"))
+    return kept, unmatched
+
+
+def _compact_postgres(conn, table_name):
+    """Convert the table's columns in place. Returns (rows kept, rows unmatched)."""
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS org_code VARCHAR"))
+    conn.execute(text(
+        f"UPDATE {table_name} a SET org_code = s.org_code FROM student s "
+        "WHERE s.student_id = a.student_id AND a.org_code IS NULL"
+    ))
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN student_pk INTEGER, ADD COLUMN subject_id INTEGER"))
+    conn.execute(text(
+        f"UPDATE {table_name} a SET student_pk = s.id FROM student s WHERE s.student_id = a.student_id"
+    ))
+    conn.execute(text(
+        f"UPDATE {table_name} a SET subject_id = sub.id FROM subject sub "
+        "WHERE sub.name = a.subject AND sub.org_code IS NOT DISTINCT FROM a.org_code"
+    ))
+
+    unkeyable = "student_pk IS NULL OR subject_id IS NULL OR status NOT IN ('P', 'A', 'L')"
+    unmatched = conn.execute(text(f"SELECT COUNT(*) FROM {table_name} WHERE {unkeyable}")).scalar()
+    if unmatched:
+        conn.execute(text(f"CREATE TABLE {table_name}_unmatched AS SELECT * FROM {table_name} WHERE {unkeyable}"))
+        conn.execute(text(f"DELETE FROM {table_name} WHERE {unkeyable}"))
+
+    # Dropping the string columns also drops the old unique key, foreign key and indexes on them
+    changes = [
+        "ALTER COLUMN status DROP DEFAULT",
+        f"ALTER COLUMN status TYPE SMALLINT USING {_status_code('status')}",
+        "ALTER COLUMN student_pk SET NOT NULL",
+        "ALTER COLUMN subject_id SET NOT NULL",
+        "DROP COLUMN student_id",
+        "DROP COLUMN subject",
+    ]
+    # Archives copied from the live table before prev_status existed lack it
+    if "prev_status" in _columns(conn, table_name):
+        changes.append(f"ALTER COLUMN prev_status TYPE SMALLINT USING {_status_code('prev_status')}")
+    conn.execute(text(f"ALTER TABLE {table_name} {', '.join(changes)}"))
+    if table_name == "attendance":
+        for constraint in Attendance.__table__.constraints:
+            if not isinstance(constraint, PrimaryKeyConstraint):
+                conn.execute(AddConstraint(constraint))
+        # Dropping the columns dropped their indexes; the model's also cover revision
+        for index in Attendance.__table__.indexes:
+            index.create(conn, checkfirst=True)
+    kept = conn.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar()
+    return kept, unmatched
+
+
+def compact_attendance(conn):
+    """
+    Convert string-keyed attendance tables (see module docstring).
+    Returns the number of rows converted (0 when there was nothing to do).
+    """
+    tables = _legacy_tables(conn)
+    if not tables:
+        return 0
+
+    # The views read the columns being replaced; they are recreated at the end
+    conn.execute(text(f"DROP VIEW IF EXISTS {HISTORY_VIEW}"))
+    if conn.dialect.name != "postgresql":
+        conn.execute(text(f"DROP VIEW IF EXISTS {ARCHIVE_VIEW}"))
+    if "attendance" in tables:
+        _prepare_live_table(conn)
+    _create_subjects(conn, tables)
+
+    converted = 0
+    for table_name in tables:
+        compact = _compact_postgres if conn.dialect.name == "postgresql" else _compact_sqlite
+        kept, unmatched = compact(conn, table_name)
+        converted += kept
+        print(f"[Compact] Converted {kept} rows of {table_name} to integer keys")
+        if unmatched:
+            print(f"[Compact] Warning: {unmatched} rows of {table_name} have no student or a bad status; "
+                  f"moved to {table_name}_unmatched")
+    ensure_history_views(conn)
+    return converted
+
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    with engine.begin() as conn:
+        rows = compact_attendance(conn)
+    if not rows:
+        print("[Compact] Attendance already uses integer keys")
+    sys.exit(0)
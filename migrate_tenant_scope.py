@@ -0,0 +1,129 @@
+"""
+Migration: scope Student and Attendance rows to an organization (org_code).
+Run: python migrate_tenant_scope.py [DEFAULT_ORG_CODE]
+
+1. Adds org_code to student and attendance if missing, with the
+   org-leading composite indexes (converting attendance to integer keys
+   first, see migrate_compact_attendance.py).
+2. Assigns every student without an org:
+   - to the only organization, when there is just one;
+   - else to the one org whose daily rollup has the student's class and division;
+   - else to DEFAULT_ORG_CODE when given. Students still unassigned are reported.
+3. Copies each student's org_code onto their live and archived attendance,
+   and onto the subjects of those rows.
+4. Rebuilds the daily rollup of every org from its own rows.
+Safe to run more than once; the app also runs it on startup without a default.
+"""
+import sys
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
+
+from database import engine, create_db_and_tables
+from models import AttendanceDailyRollup, Organization
+from archive_utils import ARCHIVE_VIEW, YEAR_TABLE_PATTERN, ensure_history_views
+from attendance_utils import rebuild_daily_rollup
+from migrate_compact_attendance import compact_attendance
+
+TENANT_INDEXES = {
+    "ix_student_org_class_division_roll": "student (org_code, class_name, division, roll_no)",
+    "ix_attendance_org_date_summary": "attendance (org_code, date, subject_id, student_pk, status)",
+    "ix_attendance_org_revision": "attendance (org_code, revision)",
+    "ix_rollup_org_class_subject_date":
+        "attendancedailyrollup (org_code, class_name, division, subject, date)",
+}
+
+# Older indexes now covered by a wider one above
+SUPERSEDED_INDEXES = ("ix_attendance_org_date",)
+
+
+def ensure_tenant_columns(conn):
+    """Add the org_code columns and org-leading indexes if they are missing."""
+    inspector = inspect(conn)
+    for table_name in ("student", "attendance"):
+        if "org_code" not in {c["name"] for c in inspector.get_columns(table_name)}:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN org_code VARCHAR"))
+            print(f"[Tenant] Added org_code column to {table_name}")
+    # The attendance indexes are on the integer keys
+    compact_attendance(conn)
+    for name, definition in TENANT_INDEXES.items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
+    for name in SUPERSEDED_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _archive_tables(conn):
+    if conn.dialect.name == "postgresql":
+        return [ARCHIVE_VIEW] if inspect(conn).has_table(ARCHIVE_VIEW) else []
+    return [name for name in inspect(conn).get_table_names() if YEAR_TABLE_PATTERN.match(name)]
+
+
+def backfill_org_codes(default_org_code=None):
+    """
+    Tag untagged students and attendance with their org (see module docstring).
+    Returns the number of students left without an org.
+    """
+    rollup = AttendanceDailyRollup.__tablename__
+    with engine.begin() as conn:
+        ensure_tenant_columns(conn)
+        ensure_history_views(conn)  # Adds org_code to archives that predate it
+
+        orgs = conn.execute(select(Organization.org_code)).scalars().all()
+        if len(orgs) == 1:
+            default_org_code = default_org_code or orgs[0]
+        else:
+            # Leaves the student NULL when no org, or several, recorded the class
+            conn.execute(text(
+                f"UPDATE student SET org_code = ("
+                f"SELECT MIN(r.org_code) FROM {rollup} r "
+                f"WHERE r.class_name = student.class_name AND r.division = student.division "
+                f"HAVING COUNT(DISTINCT r.org_code) = 1"
+                f") WHERE org_code IS NULL"
+            ))
+        if default_org_code:
+            students = conn.execute(
+                text("UPDATE student SET org_code = :org WHERE org_code IS NULL"),
+                {"org": default_org_code.upper()}
+            ).rowcount
+            if students:
+                print(f"[Tenant] Assigned {students} students to {default_org_code.upper()}")
+
+        tagged = 0
+        for table_name in ("attendance", *_archive_tables(conn)):
+            owner = f"SELECT org_code FROM student WHERE student.id = {table_name}.student_pk"
+            tagged += conn.execute(text(
+                f"UPDATE {table_name} SET org_code = ({owner}) "
+                f"WHERE org_code IS NULL AND ({owner}) IS NOT NULL"
+            )).rowcount
+            # Rows converted to integer keys before their org was known have org-less
+            # subjects (see migrate_compact_attendance.py); point them at the org's own
+            conn.execute(text(
+                f"INSERT INTO subject (org_code, name) "
+                f"SELECT DISTINCT a.org_code, sub.name FROM {table_name} a JOIN subject sub ON sub.id = a.subject_id "
+                f"WHERE sub.org_code IS NULL AND a.org_code IS NOT NULL AND NOT EXISTS ("
+                f"SELECT 1 FROM subject own WHERE own.org_code = a.org_code AND own.name = sub.name)"
+            ))
+            conn.execute(text(
+                f"UPDATE {table_name} SET subject_id = ("
+                f"SELECT own.id FROM subject sub JOIN subject own "
+                f"ON own.name = sub.name AND own.org_code = {table_name}.org_code "
+                f"WHERE sub.id = {table_name}.subject_id"
+                f") WHERE org_code IS NOT NULL AND subject_id IN (SELECT id FROM subject WHERE org_code IS NULL)"
+            ))
+        unassigned = conn.execute(text("SELECT COUNT(*) FROM student WHERE org_code IS NULL")).scalar()
+
+    if tagged:
+        print(f"[Tenant] Tagged {tagged} attendance rows with their student's org")
+        with Session(engine) as session:
+            for org_code in orgs:
+                rebuild_daily_rollup(session, org_code)
+        print(f"[Tenant] Rebuilt daily rollups for {len(orgs)} organizations")
+    if unassigned:
+        print(f"[Tenant] Warning: {unassigned} students have no org - "
+              "run: python migrate_tenant_scope.py DEFAULT_ORG_CODE")
+    return unassigned
+
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    left = backfill_org_codes(sys.argv[1] if len(sys.argv) > 1 else None)
+    sys.exit(1 if left else 0)
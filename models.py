@@ -1,5 +1,6 @@
 from typing import Optional
-from sqlmodel import Field, SQLModel
+from sqlalchemy import CheckConstraint, Index, SmallInteger, TypeDecorator, UniqueConstraint, text
+from sqlmodel import Field, Relationship, SQLModel
 from datetime import date as dt_date, datetime
 
 class Organization(SQLModel, table=True):
@@ -24,28 +25,165 @@ class User(SQLModel, table=True):
     # Composite unique constraint: (org_code, username) would be ideal
 
 class Student(SQLModel, table=True):
+    # Tenant-leading index for class rosters
+    __table_args__ = (
+        Index("ix_student_org_class_division_roll", "org_code", "class_name", "division", "roll_no"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
+    # Owning organization; NULL only for rows not yet backfilled (migrate_tenant_scope.py)
+    org_code: Optional[str] = Field(default=None, foreign_key="organization.org_code")
     student_id: str = Field(index=True, unique=True)  # STU0001
     name: str
     class_name: str = Field(index=True)   # e.g. "FY", "SY", "10th"
     division: str = Field(default="A", index=True)  # e.g. "A", "B", "C"
     roll_no: int
 
+# Attendance status codes as stored; the API and the code see the letters
+ATTENDANCE_STATUS_CODES = {"P": 1, "A": 2, "L": 3}
+_STATUS_LETTERS = {code: letter for letter, code in ATTENDANCE_STATUS_CODES.items()}
+
+class StatusCode(TypeDecorator):
+    """A "P" / "A" / "L" status stored as a small int (see ATTENDANCE_STATUS_CODES)."""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # Unknown letters bind as NULL, so filtering on them matches nothing
+        return ATTENDANCE_STATUS_CODES.get(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else _STATUS_LETTERS[value]
+
+class Subject(SQLModel, table=True):
+    """Subjects of an organization; attendance refers to them by id."""
+    __table_args__ = (
+        UniqueConstraint("org_code", "name", name="uq_subject_org_name"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    org_code: Optional[str] = None
+    name: str
+
 class Attendance(SQLModel, table=True):
+    # One mark per student, subject and day - writes upsert against this key
+    __table_args__ = (
+        UniqueConstraint("student_pk", "subject_id", "date", name="uq_attendance_student_subject_date"),
+        # Tenant-leading indexes for per-org date ranges and the per-org change feed.
+        # The date index also covers the columns the class summary aggregates,
+        # so date-range scans never touch the table.
+        Index("ix_attendance_org_date_summary", "org_code", "date", "subject_id", "student_pk", "status"),
+        Index("ix_attendance_org_revision", "org_code", "revision"),
+        CheckConstraint("status IN (1, 2, 3)", name="ck_attendance_status"),
+        CheckConstraint("prev_status IS NULL OR prev_status IN (1, 2, 3)", name="ck_attendance_prev_status"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    student_id: str = Field(foreign_key="student.student_id", index=True)
-    subject: str = Field(index=True)
-    date: dt_date
-    status: str = Field(default="P")  # "P" = Present, "A" = Absent, "L" = Late
-    
+    # Copied from the student on write
+    org_code: Optional[str] = None
+    # Integer keys of the student (Student.id, not the STU0001-style code) and subject
+    student_pk: int = Field(foreign_key="student.id")
+    subject_id: int = Field(foreign_key="subject.id")
+    date: dt_date = Field(index=True)
+    # "P" = Present, "A" = Absent, "L" = Late; stored as 1 / 2 / 3
+    status: str = Field(default="P", sa_type=StatusCode, nullable=False)
+    # Status before the last upsert (None for a fresh insert); internal only
+    prev_status: Optional[str] = Field(default=None, sa_type=StatusCode, exclude=True)
+    # Change-feed position (bumped on every write) and last-writer-wins timestamp
+    revision: int = Field(default=0, index=True)
+    updated_at: Optional[datetime] = None
+
+    student_ref: Optional[Student] = Relationship()
+    subject_ref: Optional[Subject] = Relationship()
+
+    # Fields of the old string-keyed row, for code holding Attendance objects
+    @property
+    def student_id(self) -> Optional[str]:
+        return self.student_ref.student_id if self.student_ref else None
+
+    @property
+    def subject(self) -> Optional[str]:
+        return self.subject_ref.name if self.subject_ref else None
+
     # Legacy field for backwards compat (derived from status)
     @property
     def present(self) -> bool:
         return self.status == "P"
 
+class RevisionCounter(SQLModel, table=True):
+    """Monotonic counters, e.g. an org's attendance change-feed revision ("attendance:<org_code>")."""
+    name: str = Field(primary_key=True)
+    value: int = Field(default=0)
+
+class AttendanceDailyRollup(SQLModel, table=True):
+    """P/A/L counts per org, day, class, division and subject (maintained on write)."""
+    __table_args__ = (
+        UniqueConstraint("org_code", "date", "class_name", "division", "subject", name="uq_rollup_key"),
+        # Class-first order lets per-class session counts stream without sorting
+        Index("ix_rollup_org_class_subject_date", "org_code", "class_name", "division", "subject", "date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    org_code: str = Field(index=True)
+    date: dt_date = Field(index=True)
+    class_name: str
+    division: str
+    subject: str
+    present: int = Field(default=0)
+    absent: int = Field(default=0)
+    late: int = Field(default=0)
+
+class StudentSubjectTotals(SQLModel, table=True):
+    """Running P/A/L totals per student and subject (maintained on write)."""
+    __table_args__ = (
+        UniqueConstraint("student_id", "subject", name="uq_totals_student_subject"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    student_id: str
+    subject: str
+    present: int = Field(default=0)
+    absent: int = Field(default=0)
+    late: int = Field(default=0)
+    total: int = Field(default=0)
+    last_date: Optional[dt_date] = None
+
+class AbsenceStreak(SQLModel, table=True):
+    """
+    Current and longest run of consecutive absences per student and subject,
+    plus one row per student with subject "*" for whole days absent
+    (maintained on write, see streak_utils.py).
+    """
+    __table_args__ = (
+        UniqueConstraint("student_id", "subject", name="uq_streak_student_subject"),
+        # /attendance/streaks?min_days= is a range scan on this index
+        Index("ix_streak_org_subject_current", "org_code", "subject", "current"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    org_code: Optional[str] = None
+    student_id: str
+    subject: str
+    current: int = Field(default=0)
+    longest: int = Field(default=0)
+    current_start: Optional[dt_date] = None  # First day of the current run
+    longest_end: Optional[dt_date] = None  # Last day of the longest run, when known
+    last_date: Optional[dt_date] = None  # Latest working day counted
+
 class Holiday(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint("org_code", "date", name="uq_holiday_org_date"),
+        # NULLs never conflict in the constraint above, so shared holidays need their own
+        Index(
+            "uq_holiday_shared_date", "date", unique=True,
+            sqlite_where=text("org_code IS NULL"), postgresql_where=text("org_code IS NULL")
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: dt_date = Field(unique=True)
+    # NULL for holidays shared by every organization (see holiday_utils.py)
+    org_code: Optional[str] = Field(default=None, foreign_key="organization.org_code")
+    date: dt_date = Field(index=True)
     name: str
     holiday_type: str  # 'national' or 'gazetted'
 
@@ -58,3 +196,19 @@ class TeacherInvite(SQLModel, table=True):
     used: bool = Field(default=False)
     used_at: Optional[datetime] = None
     used_by_username: Optional[str] = None  # Username of teacher who used it
+
+class IdempotencyKey(SQLModel, table=True):
+    """Stored result of a write request, replayed when the same Idempotency-Key is retried."""
+    __table_args__ = (
+        UniqueConstraint("org_code", "endpoint", "key", name="uq_idempotency_key"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    org_code: str
+    endpoint: str  # e.g. "POST /attendance/bulk"
+    key: str
+    request_hash: str  # SHA-256 of the request body, to reject reuse with other data
+    response_hash: str  # SHA-256 of the stored response body
+    response_body: str  # JSON
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
@@ -0,0 +1,42 @@
+"""
+Rebuild derived attendance tables from raw attendance rows, live and archived.
+Run: python rebuild_rollups.py [ORG_CODE]
+Without ORG_CODE the daily rollup of every organization is rebuilt.
+"""
+import sys
+from sqlmodel import Session, select, func
+from database import engine, create_db_and_tables
+from models import AbsenceStreak, Organization, AttendanceDailyRollup, StudentSubjectTotals
+from archive_utils import attendance_source
+from attendance_utils import rebuild_daily_rollup, rebuild_student_totals
+from streak_utils import rebuild_absence_streaks
+
+
+def rebuild(org_code=None):
+    with Session(engine) as session:
+        org_codes = [org_code.upper()] if org_code else session.exec(select(Organization.org_code)).all()
+        for code in org_codes:
+            rows = rebuild_daily_rollup(session, code)
+            print(f"[Rollup] Rebuilt {rows} daily rollup rows for {code}")
+        rows = rebuild_student_totals(session)
+        print(f"[Rollup] Rebuilt {rows} student subject totals")
+        rows = rebuild_absence_streaks(session)
+        print(f"[Rollup] Rebuilt {rows} absence streaks")
+        return True
+
+
+def rebuild_if_empty():
+    """Build the derived tables once for databases that predate them (called on startup)."""
+    with Session(engine) as session:
+        has_rollup = session.exec(select(func.count(AttendanceDailyRollup.id))).one() > 0
+        has_totals = session.exec(select(func.count(StudentSubjectTotals.id))).one() > 0
+        has_streaks = session.exec(select(func.count(AbsenceStreak.id))).one() > 0
+        has_attendance = session.exec(select(func.count()).select_from(attendance_source())).one() > 0
+    if has_attendance and not (has_rollup and has_totals and has_streaks):
+        rebuild()
+
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    ok = rebuild(sys.argv[1] if len(sys.argv) > 1 else None)
+    sys.exit(0 if ok else 1)
@@ -1,7 +1,8 @@
 """
 Attendance Reports Module
 Generates reports for students, classes, and subjects.
-Supports CSV export.
+Supports CSV export, plus Parquet / Arrow IPC export of the attendance
+database for analytics (requires the optional pyarrow package).
 """
 
 import csv
@@ -13,6 +14,12 @@ from students import get_student, get_students_by_class, get_all_classes
 REPORTS_DIR = "reports"
 DATE_FORMAT = "%d-%m-%Y"
 
+# Rows per Parquet row group / Arrow record batch in columnar exports
+COLUMNAR_BATCH_SIZE = 65536
+
+# Low-cardinality columns stored dictionary-encoded in columnar exports
+DICTIONARY_COLUMNS = ("class_name", "division", "subject", "status")
+
 def ensure_reports_dir():
     """Ensure reports directory exists."""
     if not os.path.exists(REPORTS_DIR):
@@ -240,3 +247,88 @@ def export_student_report_csv(student_id):
         writer.writerow(["OVERALL", report["overall"]["present"], report["overall"]["total"], report["overall"]["percentage"]])
     
     return filepath, f"Report exported to {filepath}"
+
+def _columnar_schema(pa):
+    """Arrow schema of the Attendance/Student join used by columnar exports."""
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("id", pa.int64()),
+        ("student_id", pa.string()),
+        ("name", pa.string()),
+        ("roll_no", pa.int32()),
+        ("class_name", text),
+        ("division", text),
+        ("subject", text),
+        ("date", pa.date32()),
+        ("status", text),
+    ])
+
+def export_attendance_columnar(fmt="parquet", org_code=None, start_date=None, end_date=None, subject=None,
+                               class_name=None, division=None, status=None, directory=REPORTS_DIR):
+    """
+    Export an org's attendance joined with student info from the database to
+    a Parquet (fmt="parquet") or Arrow IPC file (fmt="arrow").
+    Rows are read in batches and written as one row group / record batch
+    each. Class, division, subject and status are dictionary-encoded with
+    dictionaries that only grow, so later batches carry deltas.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None, "Columnar export needs the pyarrow package (pip install pyarrow)"
+
+    from sqlmodel import Session
+    from database import engine
+    from attendance_utils import build_report_query
+
+    if fmt not in ("parquet", "arrow"):
+        return None, f"Unknown export format '{fmt}'"
+
+    if directory == REPORTS_DIR:
+        ensure_reports_dir()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = "parquet" if fmt == "parquet" else "arrow"
+    filepath = os.path.join(directory, f"attendance_{timestamp}.{extension}")
+
+    schema = _columnar_schema(pa)
+    dictionaries = {column: {} for column in DICTIONARY_COLUMNS}
+
+    def encode(column, values):
+        # Append unseen values so each batch's dictionary extends the previous one
+        lookup = dictionaries[column]
+        indices = [lookup.setdefault(value, len(lookup)) for value in values]
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, pa.int32()), pa.array(list(lookup), pa.string())
+        )
+
+    query = build_report_query(org_code, start_date, end_date, subject, class_name, division, status)
+    query = query.order_by("date", "id").execution_options(yield_per=COLUMNAR_BATCH_SIZE)
+
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(filepath, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(
+            filepath, schema,
+            options=pa.ipc.IpcWriteOptions(compression="zstd", emit_dictionary_deltas=True)
+        )
+
+    rows_written = 0
+    with Session(engine) as session, writer:
+        for batch in session.exec(query).partitions():
+            ids, student_ids, names, roll_nos, classes, divisions, subjects, dates, statuses = zip(*batch)
+            record_batch = pa.record_batch([
+                pa.array(ids, pa.int64()),
+                pa.array(student_ids, pa.string()),
+                pa.array(names, pa.string()),
+                pa.array(roll_nos, pa.int32()),
+                encode("class_name", [c or "" for c in classes]),
+                encode("division", [d or "" for d in divisions]),
+                encode("subject", subjects),
+                pa.array(dates, pa.date32()),
+                encode("status", statuses),
+            ], schema=schema)
+            writer.write_batch(record_batch)
+            rows_written += len(batch)
+
+    return filepath, f"Exported {rows_written} records to {filepath}"
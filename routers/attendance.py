@@ -1,229 +1,901 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from sqlmodel import Session, select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import and_, case, or_
 from typing import List, Optional
-from datetime import date as dt_date, timedelta
+from datetime import date as dt_date, timedelta, timezone
 from collections import defaultdict
-
-from database import get_session
-from models import Attendance, User, Student
-from schemas import AttendanceCreate, AttendanceRead, BulkAttendanceCreate
-from routers.auth import get_current_user
+import asyncio
+import base64
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from database import engine, get_async_session, get_session
+from models import AbsenceStreak, Attendance, AttendanceDailyRollup, User, Student, StudentSubjectTotals, Subject
+from schemas import AttendanceCreate, AttendanceRead, BulkAttendanceCreate, SyncRequest
+from routers.auth import get_current_user, get_current_user_async, get_current_user_for_stream
+from reports import export_attendance_columnar
+from analytics_utils import build_attendance_matrix, default_term_end, project_term_end
+from archive_utils import academic_year_of, archived_years, attendance_source, history_table, is_archived_date
+from idempotency_utils import find_replay, hash_payload, store_result
+from cache_utils import check_not_modified, validators
+from event_utils import stats_broker
+from streak_utils import ALL_SUBJECTS, update_absence_streaks
+import write_behind_utils
+from attendance_utils import (
+    VALID_STATUSES, build_class_summary_query, build_report_query, get_student_classes,
+    notify_write, update_daily_rollup, update_student_totals, upsert_attendance
+)
 
 router = APIRouter()
 
+# Rows fetched per server-side cursor batch when streaming exports
+EXPORT_BATCH_SIZE = 1000
+
+COLUMNAR_MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+# Minimum seconds between two SSE stats events, and keep-alive period
+STATS_STREAM_INTERVAL = 1.0
+STATS_STREAM_KEEPALIVE = 15.0
+
+# Latest stats payload per org, keyed by its ETag (see _stats_snapshot)
+_stats_snapshots: dict = {}
+
+REPORT_COLUMNS = ["id", "student_id", "name", "roll_no", "class_name", "division", "subject", "date", "status"]
+
 
 @router.post("/", response_model=AttendanceRead)
 def mark_attendance(
     attendance: AttendanceCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    # Verify student exists
-    statement = select(Student).where(Student.student_id == attendance.student_id)
+    """
+    Mark one student. Retries carrying the same Idempotency-Key replay the first result.
+    In write-behind mode the mark is journaled and queued and 202 is returned
+    (503 with Retry-After when the queue is full); queued marks are upserts,
+    so a retried request is harmless and is not recorded as a replay.
+    """
+    if idempotency_key:
+        request_hash = hash_payload(attendance.model_dump(mode="json"))
+        replay = find_replay(session, current_user.org_code, "POST /attendance/", idempotency_key, request_hash)
+        if replay:
+            return replay
+
+    if attendance.status not in VALID_STATUSES:
+        raise HTTPException(status_code=400, detail="Status must be one of P, A, L")
+    if is_archived_date(attendance.date):
+        raise HTTPException(status_code=400, detail="This academic year has been archived")
+
+    # Verify student exists in the caller's org
+    statement = select(Student).where(
+        Student.org_code == current_user.org_code, Student.student_id == attendance.student_id
+    )
     student = session.exec(statement).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
 
-    # Upsert: check if already marked for this date+student+subject
-    statement = select(Attendance).where(
-        Attendance.student_id == attendance.student_id,
-        Attendance.date == attendance.date,
-        Attendance.subject == attendance.subject
-    )
-    existing = session.exec(statement).first()
-
-    if existing:
-        existing.status = attendance.status
-        session.add(existing)
-        session.commit()
-        session.refresh(existing)
-        return existing
-
-    db_attendance = Attendance(
-        student_id=attendance.student_id,
-        subject=attendance.subject,
-        date=attendance.date,
-        status=attendance.status
+    if write_behind_utils.ENABLED:
+        try:
+            write_behind_utils.enqueue(
+                current_user.org_code, attendance.student_id, attendance.subject,
+                attendance.date, attendance.status
+            )
+        except write_behind_utils.QueueFull:
+            raise HTTPException(
+                status_code=503, detail="Attendance queue is full, retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        return JSONResponse(
+            status_code=202,
+            content={"message": "Attendance queued", **attendance.model_dump(mode="json")}
+        )
+
+    # One INSERT ... ON CONFLICT DO UPDATE against the (student, subject, date)
+    # key, so simultaneous marks of the same student cannot duplicate the row
+    row = upsert_attendance(
+        session, current_user.org_code, attendance.subject, attendance.date,
+        {attendance.student_id: attendance.status}, full_rows=True
+    )[0]
+    written = [(row["student_id"], row["status"], row["prev_status"])]
+    update_daily_rollup(
+        session, current_user.org_code, attendance.subject, attendance.date, written,
+        {student.student_id: (student.class_name, student.division)}
     )
-    session.add(db_attendance)
+    update_student_totals(session, attendance.subject, attendance.date, written)
+    update_absence_streaks(session, current_user.org_code, attendance.subject, attendance.date, written)
+
+    result = AttendanceRead(**row)
+    if idempotency_key:
+        store_result(
+            session, current_user.org_code, "POST /attendance/", idempotency_key, request_hash,
+            result.model_dump(mode="json")
+        )
     session.commit()
-    session.refresh(db_attendance)
-    return db_attendance
+    notify_write(current_user.org_code)
+    return result
+
+
+def _apply_bulk(session: Session, bulk_data: BulkAttendanceCreate, org_code: str) -> dict:
+    """
+    Upsert a roll call and its derived rows; returns the bulk response.
+    All submitted students are checked in one query. Items with an invalid
+    status, a student unknown to the org or one outside the posted class and
+    division are listed in `rejections`; the rest are still written.
+    Does not commit.
+    """
+    marks = {}
+    rejections = []
+    for item in bulk_data.items:
+        if item.status not in VALID_STATUSES:
+            rejections.append({"student_id": item.student_id, "reason": "invalid status"})
+            continue
+        marks[item.student_id] = item.status  # Last entry wins for repeated IDs
+
+    student_classes = get_student_classes(session, marks.keys(), org_code)
+    roll_class = (bulk_data.class_name, bulk_data.division)
+    for student_id in list(marks):
+        if student_id not in student_classes:
+            rejections.append({"student_id": student_id, "reason": "unknown student"})
+        elif student_classes[student_id] != roll_class:
+            rejections.append({"student_id": student_id, "reason": "wrong class"})
+        else:
+            continue
+        del marks[student_id]
+
+    written = upsert_attendance(session, org_code, bulk_data.subject, bulk_data.date, marks) if marks else []
+    update_daily_rollup(session, org_code, bulk_data.subject, bulk_data.date, written, student_classes)
+    update_student_totals(session, bulk_data.subject, bulk_data.date, written)
+    update_absence_streaks(session, org_code, bulk_data.subject, bulk_data.date, written)
+
+    inserted = sum(1 for _, _, prev_status in written if prev_status is None)
+    return {
+        "message": "Bulk attendance marked successfully",
+        "inserted": inserted,
+        "updated": len(written) - inserted,
+        "rejected": len(rejections),
+        "rejections": rejections
+    }
 
 
 @router.post("/bulk")
-def mark_bulk_attendance(
+async def mark_bulk_attendance(
     bulk_data: BulkAttendanceCreate,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
 ):
-    for item in bulk_data.items:
-        statement = select(Attendance).where(
-            Attendance.student_id == item.student_id,
-            Attendance.date == bulk_data.date,
-            Attendance.subject == bulk_data.subject
+    """
+    Upsert the whole roll call in one statement and report what changed,
+    with a reason for every rejected item. Retries carrying the same
+    Idempotency-Key replay the first result.
+    """
+    if idempotency_key:
+        request_hash = hash_payload(bulk_data.model_dump(mode="json"))
+        replay = await session.run_sync(
+            find_replay, current_user.org_code, "POST /attendance/bulk", idempotency_key, request_hash
         )
-        existing = session.exec(statement).first()
+        if replay:
+            return replay
 
-        if existing:
-            existing.status = item.status
-            session.add(existing)
-        else:
-            new_record = Attendance(
-                student_id=item.student_id,
-                subject=bulk_data.subject,
-                date=bulk_data.date,
-                status=item.status
-            )
-            session.add(new_record)
+    if is_archived_date(bulk_data.date):
+        raise HTTPException(status_code=400, detail="This academic year has been archived")
 
-    session.commit()
-    return {"message": "Bulk attendance marked successfully"}
+    result = await session.run_sync(_apply_bulk, bulk_data, current_user.org_code)
+    if idempotency_key:
+        await session.run_sync(
+            store_result, current_user.org_code, "POST /attendance/bulk", idempotency_key, request_hash, result
+        )
+    await session.commit()
+    notify_write(current_user.org_code)
+    return result
 
 
-@router.get("/stats")
-def get_attendance_stats(
-    target_date: Optional[dt_date] = None,
+def _parse_sync_cursor(cursor: Optional[str]):
+    """Return (revision, id) from a change-feed cursor ("<revision>.<id>" or "<revision>")."""
+    if not cursor:
+        return -1, 0
+    try:
+        revision, _, record_id = cursor.partition(".")
+        return int(revision), int(record_id or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/changes")
+async def get_attendance_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
+):
+    """
+    Change feed for offline devices: records written after `since`, in
+    revision order. Start with no cursor, then pass back `next_cursor`
+    until `has_more` is false; keep the last cursor for the next sync.
+    """
+    since_revision, since_id = _parse_sync_cursor(since)
+    rows = (await session.exec(
+        select(
+            Attendance.id, Student.student_id, Subject.name.label("subject"), Attendance.date,
+            Attendance.status, Attendance.revision, Attendance.updated_at
+        )
+        .join(Student, Student.id == Attendance.student_pk)
+        .join(Subject, Subject.id == Attendance.subject_id)
+        .where(Attendance.org_code == current_user.org_code)
+        .where(or_(
+            Attendance.revision > since_revision,
+            and_(Attendance.revision == since_revision, Attendance.id > since_id)
+        ))
+        .order_by(Attendance.revision, Attendance.id)
+        .limit(limit + 1)
+    )).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = f"{rows[-1].revision}.{rows[-1].id}" if rows else since
+
+    return {
+        "changes": [
+            {
+                "id": r.id,
+                "student_id": r.student_id,
+                "subject": r.subject,
+                "date": str(r.date),
+                "status": r.status,
+                "revision": r.revision,
+                "updated_at": r.updated_at.isoformat() if r.updated_at else None
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }
+
+
+@router.post("/sync")
+def sync_attendance(
+    sync_data: SyncRequest,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Return today's (or a specific date's) P/A/L counts and total students."""
-    if target_date is None:
-        target_date = dt_date.today()
+    """
+    Apply marks queued on an offline device. Conflicts are resolved by
+    last writer wins on `marked_at`: a mark older than the stored one is
+    skipped. Marks are grouped per subject and date and upserted in batches.
+    """
+    groups: dict = defaultdict(dict)
+    rejected = []
+    archived = archived_years()
+    for mark in sync_data.marks:
+        if mark.status not in VALID_STATUSES:
+            rejected.append({"student_id": mark.student_id, "subject": mark.subject,
+                             "date": str(mark.date), "reason": "invalid status"})
+            continue
+        if academic_year_of(mark.date) in archived:
+            rejected.append({"student_id": mark.student_id, "subject": mark.subject,
+                             "date": str(mark.date), "reason": "academic year archived"})
+            continue
+        marked_at = mark.marked_at
+        if marked_at.tzinfo is not None:
+            marked_at = marked_at.astimezone(timezone.utc).replace(tzinfo=None)
+        # Within one batch the latest mark for a key wins, as it would on the server
+        previous = groups[(mark.subject, mark.date)].get(mark.student_id)
+        if previous is None or previous[1] < marked_at:
+            groups[(mark.subject, mark.date)][mark.student_id] = (mark.status, marked_at)
+
+    student_classes = get_student_classes(
+        session, {student_id for group in groups.values() for student_id in group}, current_user.org_code
+    )
+    for (subject, day), group in groups.items():
+        for student_id in [student_id for student_id in group if student_id not in student_classes]:
+            del group[student_id]
+            rejected.append({"student_id": student_id, "subject": subject,
+                             "date": str(day), "reason": "unknown student"})
+
+    applied = 0
+    submitted = sum(len(group) for group in groups.values())
+    for (subject, day), group in groups.items():
+        if not group:
+            continue
+        written = upsert_attendance(
+            session, current_user.org_code, subject, day,
+            {student_id: status for student_id, (status, _) in group.items()},
+            marked_at={student_id: marked_at for student_id, (_, marked_at) in group.items()},
+            only_newer=True
+        )
+        update_daily_rollup(session, current_user.org_code, subject, day, written, student_classes)
+        update_student_totals(session, subject, day, written)
+        update_absence_streaks(session, current_user.org_code, subject, day, written)
+        applied += len(written)
+    session.commit()
+    notify_write(current_user.org_code)
+
+    return {
+        "applied": applied,
+        "skipped": submitted - applied,
+        "rejected": rejected
+    }
+
 
-    records = session.exec(
-        select(Attendance).where(Attendance.date == target_date)
+def _status_counts_by_date(session: Session, org_code: str, start_date: dt_date, end_date: dt_date) -> dict:
+    """Return {date: {"P": n, "A": n, "L": n}} for an org from the daily rollup (O(days) rows)."""
+    rows = session.exec(
+        select(
+            AttendanceDailyRollup.date,
+            func.sum(AttendanceDailyRollup.present),
+            func.sum(AttendanceDailyRollup.absent),
+            func.sum(AttendanceDailyRollup.late)
+        )
+        .where(
+            AttendanceDailyRollup.org_code == org_code,
+            AttendanceDailyRollup.date >= start_date,
+            AttendanceDailyRollup.date <= end_date
+        )
+        .group_by(AttendanceDailyRollup.date)
     ).all()
 
-    present = sum(1 for r in records if r.status == "P")
-    absent = sum(1 for r in records if r.status == "A")
-    late = sum(1 for r in records if r.status == "L")
+    counts: dict = defaultdict(lambda: {"P": 0, "A": 0, "L": 0})
+    for day, present, absent, late in rows:
+        counts[day] = {"P": present, "A": absent, "L": late}
+    return counts
+
+
+def _bucket_start(day: dt_date, bucket: str) -> dt_date:
+    """First day of the day/week/month bucket containing `day` (weeks start Monday)."""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _bucket_label(start: dt_date, bucket: str) -> str:
+    if bucket == "week":
+        return start.strftime("%d %b")
+    if bucket == "month":
+        return start.strftime("%b %Y")
+    return start.strftime("%a")
 
-    total_students = session.exec(select(func.count(Student.id))).one()
+
+def _stats_payload(session: Session, org_code: str, target_date: dt_date) -> dict:
+    counts = _status_counts_by_date(session, org_code, target_date, target_date)[target_date]
+
+    total_students = session.exec(
+        select(func.count(Student.id)).where(Student.org_code == org_code)
+    ).one()
 
     return {
         "date": str(target_date),
         "total_students": total_students,
-        "present": present,
-        "absent": absent,
-        "late": late,
-        "records_today": len(records)
+        "present": counts["P"],
+        "absent": counts["A"],
+        "late": counts["L"],
+        "records_today": counts["P"] + counts["A"] + counts["L"]
     }
 
 
+def _stats_snapshot(org_code: str, target_date: dt_date) -> dict:
+    """
+    Stats payload shared by every stream subscriber of an org: it is only
+    recomputed when the org's cache validators change.
+    """
+    etag, _ = validators(("attendance", "students"), org_code, "stats", target_date)
+    cached = _stats_snapshots.get(org_code)
+    if cached and cached[0] == etag:
+        return cached[1]
+    with Session(engine) as session:
+        payload = _stats_payload(session, org_code, target_date)
+    _stats_snapshots[org_code] = (etag, payload)
+    return payload
+
+
+@router.get("/stats")
+async def get_attendance_stats(
+    request: Request,
+    response: Response,
+    target_date: Optional[dt_date] = None,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
+):
+    """
+    Return today's (or a specific date's) P/A/L counts and total students.
+    Supports conditional GET (ETag / If-None-Match).
+    """
+    if target_date is None:
+        target_date = dt_date.today()
+
+    not_modified = check_not_modified(
+        request, response, ("attendance", "students"), current_user.org_code, "stats", target_date
+    )
+    if not_modified:
+        return not_modified
+
+    return await session.run_sync(_stats_payload, current_user.org_code, target_date)
+
+
+@router.get("/stats/stream")
+async def stream_attendance_stats(
+    request: Request,
+    target_date: Optional[dt_date] = None,
+    current_user: User = Depends(get_current_user_for_stream)
+):
+    """
+    Server-Sent Events stream of the /stats payload for the caller's org.
+    An event is sent on connect and after attendance writes commit; bursts
+    of writes are coalesced to at most one event per STATS_STREAM_INTERVAL.
+    Browsers can pass the token as ?access_token= since EventSource cannot
+    set headers.
+    """
+    org_code = current_user.org_code
+
+    async def events():
+        subscription = stats_broker.subscribe(org_code)
+        try:
+            while True:
+                day = target_date or dt_date.today()
+                payload = await run_in_threadpool(_stats_snapshot, org_code, day)
+                yield f"event: stats\ndata: {json.dumps(payload)}\n\n"
+
+                # Rate limit, then wait for the next (coalesced) write
+                await asyncio.sleep(STATS_STREAM_INTERVAL)
+                while not await subscription.wait(timeout=STATS_STREAM_KEEPALIVE):
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+        finally:
+            stats_broker.unsubscribe(org_code, subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/weekly")
-def get_weekly_attendance(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+async def get_weekly_attendance(
+    request: Request,
+    response: Response,
+    days: int = Query(7, ge=1, le=366),
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
 ):
-    """Return attendance counts for the last 7 days."""
+    """
+    Return attendance counts for the last `days` days (default: 7),
+    grouped into day, week or month buckets for long-range charts.
+    Supports conditional GET (ETag / If-None-Match).
+    """
     today = dt_date.today()
-    result = []
+    not_modified = check_not_modified(
+        request, response, ("attendance",), current_user.org_code, "weekly", today, days, bucket
+    )
+    if not_modified:
+        return not_modified
+    start = today - timedelta(days=days - 1)
+    by_date = await session.run_sync(_status_counts_by_date, current_user.org_code, start, today)
+
+    # Pre-create every bucket so days without records still show up as zeros
+    buckets: dict = {}
+    day = start
+    while day <= today:
+        key = _bucket_start(day, bucket)
+        if key not in buckets:
+            buckets[key] = {"P": 0, "A": 0, "L": 0}
+        for status, count in by_date.get(day, {}).items():
+            buckets[key][status] += count
+        day += timedelta(days=1)
 
-    for i in range(6, -1, -1):
-        day = today - timedelta(days=i)
-        records = session.exec(
-            select(Attendance).where(Attendance.date == day)
-        ).all()
-        present = sum(1 for r in records if r.status == "P")
-        absent = sum(1 for r in records if r.status == "A")
-        late = sum(1 for r in records if r.status == "L")
+    result = []
+    for key, counts in buckets.items():
         result.append({
-            "date": str(day),
-            "label": day.strftime("%a"),
-            "present": present,
-            "absent": absent,
-            "late": late,
-            "total": present + absent + late
+            "date": str(key),
+            "label": _bucket_label(key, bucket),
+            "present": counts["P"],
+            "absent": counts["A"],
+            "late": counts["L"],
+            "total": counts["P"] + counts["A"] + counts["L"]
         })
 
     return result
 
 
+@router.get("/matrix")
+def get_attendance_matrix(
+    request: Request,
+    response: Response,
+    class_name: str,
+    subject: str,
+    division: str = "A",
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-(0[1-9]|1[0-2])$"),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Monthly muster roll for a class and subject (default: this month).
+    `matrix[i][j]` is the status code of `students[i]` on `dates[j]`,
+    indexing into `codes` ("" = not marked). Totals are per student and per day.
+    Supports conditional GET (ETag / If-None-Match).
+    """
+    month = month or dt_date.today().strftime("%Y-%m")
+    not_modified = check_not_modified(
+        request, response, ("attendance", "students", "holidays"), current_user.org_code,
+        "matrix", class_name, division, subject, month
+    )
+    if not_modified:
+        return not_modified
+
+    try:
+        return build_attendance_matrix(session, current_user.org_code, class_name, division, subject, month)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/defaulters")
-def get_defaulters(
+async def get_defaulters(
     threshold: float = 75.0,
     subject: Optional[str] = None,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    class_name: Optional[str] = None,
+    division: Optional[str] = None,
+    start_date: Optional[dt_date] = None,
+    end_date: Optional[dt_date] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
 ):
-    """Return students with attendance below the threshold percentage."""
-    query = select(Attendance)
+    """
+    Return students with attendance below the threshold percentage,
+    worst first. Without a date range this reads the maintained
+    per-student totals; with one it aggregates raw rows in SQL (HAVING).
+    """
+    from_totals = start_date is None and end_date is None
+    if from_totals:
+        source = StudentSubjectTotals
+        student_id, subject_name = source.student_id, source.subject
+        present, late, absent, total = (
+            StudentSubjectTotals.present, StudentSubjectTotals.late,
+            StudentSubjectTotals.absent, StudentSubjectTotals.total
+        )
+    else:
+        table = attendance_source(start_date)
+        source = table.c
+        student_id, subject_name = Student.student_id, Subject.name
+        present = func.sum(case((source.status == "P", 1), else_=0))
+        late = func.sum(case((source.status == "L", 1), else_=0))
+        absent = func.sum(case((source.status == "A", 1), else_=0))
+        total = func.count(source.id)
+    percentage = (present + late) * 100.0 / total  # Late counts as present for %
+
+    query = select(
+        student_id, Student.name, Student.class_name, Student.division,
+        Student.roll_no, subject_name, present, late, absent, total, percentage
+    ).order_by(percentage, student_id, subject_name)
+    if from_totals:
+        # Totals are keyed by student only; the org comes from the student
+        query = query.outerjoin(Student, Student.student_id == source.student_id).where(
+            Student.org_code == current_user.org_code, total > 0, percentage < threshold
+        )
+    else:
+        query = query.select_from(table).join(Student, Student.id == source.student_pk).join(
+            Subject, Subject.id == source.subject_id
+        ).where(source.org_code == current_user.org_code).group_by(
+            source.student_pk, source.subject_id, Student.student_id, Subject.name, Student.name,
+            Student.class_name, Student.division, Student.roll_no
+        ).having(percentage < threshold)
+        if start_date:
+            query = query.where(source.date >= start_date)
+        if end_date:
+            query = query.where(source.date <= end_date)
+
     if subject:
-        query = query.where(Attendance.subject == subject)
+        query = query.where(subject_name == subject)
+    if class_name:
+        query = query.where(Student.class_name == class_name)
+    if division:
+        query = query.where(Student.division == division)
+    if offset:
+        query = query.offset(offset)
+    if limit:
+        query = query.limit(limit)
+
+    return [
+        {
+            "student_id": student_id,
+            "name": name if name is not None else "Unknown",
+            "class_name": student_class or "",
+            "division": student_division or "",
+            "roll_no": roll_no or 0,
+            "subject": subj,
+            "present": p,
+            "late": l,
+            "absent": a,
+            "total": t,
+            "percentage": round(pct, 1)
+        }
+        for student_id, name, student_class, student_division, roll_no, subj, p, l, a, t, pct
+        in (await session.exec(query)).all()
+    ]
+
+
+@router.get("/streaks")
+async def get_absence_streaks(
+    min_days: int = Query(3, ge=1),
+    subject: Optional[str] = None,
+    class_name: Optional[str] = None,
+    division: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
+):
+    """
+    Students whose current run of absences is at least `min_days`, longest
+    first: whole working days absent, or consecutive `subject` sessions
+    missed when a subject is given. Each row carries its streak's subject,
+    "*" for whole days. Reads the streaks maintained on write.
+    """
+    query = (
+        select(AbsenceStreak, Student.name, Student.class_name, Student.division, Student.roll_no)
+        .join(Student, Student.student_id == AbsenceStreak.student_id)
+        .where(
+            AbsenceStreak.org_code == current_user.org_code,
+            AbsenceStreak.subject == (subject or ALL_SUBJECTS),
+            AbsenceStreak.current >= min_days
+        )
+        .order_by(AbsenceStreak.current.desc(), AbsenceStreak.student_id)
+    )
+    if class_name:
+        query = query.where(Student.class_name == class_name)
+    if division:
+        query = query.where(Student.division == division)
+    if offset:
+        query = query.offset(offset)
+    if limit:
+        query = query.limit(limit)
+
+    return [
+        {
+            "student_id": streak.student_id,
+            "name": name,
+            "class_name": student_class,
+            "division": student_division,
+            "roll_no": roll_no,
+            "subject": streak.subject,
+            "current_streak": streak.current,
+            "longest_streak": streak.longest,
+            "absent_since": str(streak.current_start) if streak.current_start else None,
+            "last_date": str(streak.last_date) if streak.last_date else None
+        }
+        for streak, name, student_class, student_division, roll_no in (await session.exec(query)).all()
+    ]
+
+
+@router.get("/class-summary")
+async def get_class_summary(
+    request: Request,
+    response: Response,
+    start_date: Optional[dt_date] = None,
+    end_date: Optional[dt_date] = None,
+    threshold: float = 75.0,
+    subject: Optional[str] = None,
+    class_name: Optional[str] = None,
+    division: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
+):
+    """
+    Per class-division and subject: sessions held, students marked, their
+    average attendance percentage and how many are below `threshold`. Late
+    counts as present. Without a date range this reads the maintained
+    per-student totals, like /defaulters; with one it aggregates raw rows.
+    Supports conditional GET (ETag / If-None-Match).
+    """
+    not_modified = check_not_modified(
+        request, response, ("attendance", "students"), current_user.org_code,
+        "class-summary", start_date, end_date, threshold, subject, class_name, division
+    )
+    if not_modified:
+        return not_modified
 
-    all_records = session.exec(query).all()
+    query = build_class_summary_query(
+        current_user.org_code, start_date, end_date, threshold, subject, class_name, division
+    )
+    return [
+        {
+            "class_name": r.class_name or "",
+            "division": r.division or "",
+            "subject": r.subject,
+            "sessions": r.sessions,
+            "students": r.students,
+            "average_percentage": round(r.average_percentage, 1),
+            "below_threshold": r.below_threshold
+        }
+        for r in (await session.exec(query)).all()
+    ]
 
-    # Group by student_id + subject
-    student_subject: dict = defaultdict(lambda: {"P": 0, "A": 0, "L": 0, "total": 0})
-    for r in all_records:
-        key = (r.student_id, r.subject)
-        student_subject[key][r.status] += 1
-        student_subject[key]["total"] += 1
 
-    defaulters = []
-    for (student_id, subj), counts in student_subject.items():
-        if counts["total"] == 0:
-            continue
-        present_count = counts["P"] + counts["L"]  # Late counts as present for %
-        percentage = (present_count / counts["total"]) * 100
-        if percentage < threshold:
-            student = session.exec(
-                select(Student).where(Student.student_id == student_id)
-            ).first()
-            defaulters.append({
-                "student_id": student_id,
-                "name": student.name if student else "Unknown",
-                "class_name": student.class_name if student else "",
-                "division": student.division if student else "",
-                "roll_no": student.roll_no if student else 0,
-                "subject": subj,
-                "present": counts["P"],
-                "late": counts["L"],
-                "absent": counts["A"],
-                "total": counts["total"],
-                "percentage": round(percentage, 1)
-            })
-
-    defaulters.sort(key=lambda x: x["percentage"])
-    return defaulters
+@router.get("/projection")
+def get_attendance_projection(
+    threshold: float = 75.0,
+    class_name: Optional[str] = None,
+    division: Optional[str] = None,
+    subject: Optional[str] = None,
+    term_end: Optional[dt_date] = None,
+    outlook: Optional[str] = Query(None, pattern="^(safe|at_risk|unrecoverable)$"),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    End-of-term projection for every student-subject (a class, or the whole
+    org without filters): best- and worst-case final percentage of the
+    current academic year's marks plus one session per remaining working day
+    until `term_end` (default: end of the academic year, at most the end of
+    the next one), and how many of those can still be missed while staying
+    at or above `threshold`. Filter with `outlook` to e.g. only `at_risk`.
+    """
+    today = dt_date.today()
+    term_end = term_end or default_term_end(today)
+    # The last day of next academic year
+    latest_term_end = default_term_end(default_term_end(today) + timedelta(days=1))
+    if term_end > latest_term_end:
+        raise HTTPException(status_code=400, detail=f"term_end must be on or before {latest_term_end}")
+    try:
+        remaining, rows = project_term_end(
+            session, current_user.org_code, class_name, division, subject, threshold, term_end, today
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if outlook:
+        rows = [row for row in rows if row["outlook"] == outlook]
+
+    return {
+        "as_of": str(today),
+        "term_end": str(term_end),
+        "remaining_working_days": remaining,
+        "threshold": threshold,
+        "students": rows
+    }
 
 
 @router.get("/student/{student_id}", response_model=List[AttendanceRead])
 def get_student_attendance(
     student_id: str,
+    include_archived: bool = False,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    statement = select(Attendance).where(Attendance.student_id == student_id)
-    results = session.exec(statement).all()
-    return results
+    """Attendance records of a student; archived academic years only on request."""
+    source = (history_table if include_archived else Attendance.__table__).c
+    columns = [source.id, source.org_code, Student.student_id, Subject.name.label("subject"), source.date, source.status]
+    if not include_archived:
+        columns += [source.revision, source.updated_at]  # Not kept for archived rows
+    query = (
+        select(*columns)
+        .join(Student, Student.id == source.student_pk)
+        .join(Subject, Subject.id == source.subject_id)
+        .where(source.org_code == current_user.org_code, Student.student_id == student_id)
+    )
+    if include_archived:
+        query = query.order_by(source.date, source.id)
+    return [dict(row._mapping) for row in session.exec(query).all()]
+
+
+@router.get("/student/{student_id}/summary")
+async def get_student_summary(
+    student_id: str,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Per-subject and overall attendance for a student, read from the running totals."""
+    student = (await session.exec(
+        select(Student.id).where(Student.org_code == current_user.org_code, Student.student_id == student_id)
+    )).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    totals = (await session.exec(
+        select(StudentSubjectTotals)
+        .where(StudentSubjectTotals.student_id == student_id)
+        .order_by(StudentSubjectTotals.subject)
+    )).all()
+
+    def summarize(present, late, absent, total):
+        return {
+            "present": present,
+            "late": late,
+            "absent": absent,
+            "total": total,
+            "percentage": round((present + late) * 100 / total, 1) if total else 0.0
+        }
+
+    subjects = [
+        {"subject": t.subject, **summarize(t.present, t.late, t.absent, t.total),
+         "last_date": str(t.last_date) if t.last_date else None}
+        for t in totals
+    ]
+    overall = summarize(
+        sum(t.present for t in totals), sum(t.late for t in totals),
+        sum(t.absent for t in totals), sum(t.total for t in totals)
+    )
+
+    return {"student_id": student_id, "subjects": subjects, "overall": overall}
 
 
 @router.get("/subjects")
-def get_distinct_subjects(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+async def get_distinct_subjects(
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
 ):
-    """Return all distinct subjects that have attendance records."""
-    records = session.exec(select(Attendance.subject)).all()
-    subjects = sorted(set(records))
+    """Return all subjects that have attendance records."""
+    subjects = (await session.exec(
+        select(Subject.name).where(Subject.org_code == current_user.org_code).order_by(Subject.name)
+    )).all()
     return subjects
 
 
+def _encode_cursor(day: dt_date, record_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{day.isoformat()}|{record_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    """Return (date, id) from a report cursor, or raise 400 if it is malformed."""
+    try:
+        day, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return dt_date.fromisoformat(day), int(record_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _report_row(r) -> dict:
+    return {
+        "id": r.id,
+        "student_id": r.student_id,
+        "name": r.name if r.name is not None else "Unknown",
+        "roll_no": r.roll_no or 0,
+        "class_name": r.class_name or "",
+        "division": r.division or "",
+        "subject": r.subject,
+        "date": str(r.date),
+        "status": r.status,
+    }
+
+
 @router.get("/report")
-def get_attendance_report(
+async def get_attendance_report(
+    response: Response,
     start_date: Optional[dt_date] = None,
     end_date: Optional[dt_date] = None,
     subject: Optional[str] = None,
     class_name: Optional[str] = None,
+    division: Optional[str] = None,
     status: Optional[str] = None,
-    limit: int = 200,
-    offset: int = 0,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(200, ge=1, le=5000),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
 ):
-    """Filterable attendance report joined with student info."""
+    """
+    Filterable attendance report joined with student info.
+    Pages are ordered by (date desc, id desc). Pass the X-Next-Cursor header
+    of one page as `cursor` to fetch the next one (keyset pagination).
+    X-Total-Count carries the number of rows matching the filters; it is
+    only counted for requests without a cursor, so keep it from the first page.
+    `offset` is still honoured for older clients when no cursor is given.
+    """
     today = dt_date.today()
 
     # Default: today
@@ -231,40 +903,94 @@ def get_attendance_report(
         start_date = today
         end_date = today
 
-    query = select(Attendance)
+    query = build_report_query(current_user.org_code, start_date, end_date, subject, class_name, division, status)
+    columns = query.selected_columns
 
-    if start_date:
-        query = query.where(Attendance.date >= start_date)
-    if end_date:
-        query = query.where(Attendance.date <= end_date)
-    if subject:
-        query = query.where(Attendance.subject == subject)
-    if status:
-        query = query.where(Attendance.status == status)
+    if not cursor:
+        total_count = (await session.exec(
+            select(func.count()).select_from(query.subquery())
+        )).one()
+        response.headers["X-Total-Count"] = str(total_count)
 
-    query = query.order_by(Attendance.date.desc()).offset(offset).limit(limit)
-    records = session.exec(query).all()
+    if cursor:
+        cursor_date, cursor_id = _decode_cursor(cursor)
+        query = query.where(or_(
+            columns.date < cursor_date,
+            and_(columns.date == cursor_date, columns.id < cursor_id)
+        ))
+    elif offset:
+        query = query.offset(offset)
 
-    result = []
-    for r in records:
-        student = session.exec(
-            select(Student).where(Student.student_id == r.student_id)
-        ).first()
+    query = query.order_by(columns.date.desc(), columns.id.desc()).limit(limit)
+    rows = (await session.exec(query)).all()
 
-        # Filter by class_name if provided
-        if class_name and (not student or student.class_name != class_name):
-            continue
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1].date, rows[-1].id)
 
-        result.append({
-            "id": r.id,
-            "student_id": r.student_id,
-            "name": student.name if student else "Unknown",
-            "roll_no": student.roll_no if student else 0,
-            "class_name": student.class_name if student else "",
-            "division": student.division if student else "",
-            "subject": r.subject,
-            "date": str(r.date),
-            "status": r.status,
-        })
+    return [_report_row(r) for r in rows]
 
-    return result
+
+@router.get("/export")
+def export_attendance(
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet|arrow)$"),
+    start_date: Optional[dt_date] = None,
+    end_date: Optional[dt_date] = None,
+    subject: Optional[str] = None,
+    class_name: Optional[str] = None,
+    division: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stream every attendance record matching the report filters as CSV or
+    NDJSON. Unlike /report there is no row cap and no date default: rows are
+    read through a server-side cursor in batches and written out as they
+    arrive, so memory stays flat regardless of export size.
+    `parquet` and `arrow` return a columnar file built by reports.py.
+    """
+    if format in ("parquet", "arrow"):
+        filepath, message = export_attendance_columnar(
+            format, current_user.org_code, start_date, end_date, subject, class_name, division, status,
+            directory=tempfile.mkdtemp(prefix="attendance_export_")
+        )
+        if not filepath:
+            raise HTTPException(status_code=501, detail=message)
+        return FileResponse(
+            filepath,
+            media_type=COLUMNAR_MEDIA_TYPES[format],
+            filename=os.path.basename(filepath),
+            background=BackgroundTask(shutil.rmtree, os.path.dirname(filepath), True)
+        )
+
+    query = build_report_query(current_user.org_code, start_date, end_date, subject, class_name, division, status)
+    columns = query.selected_columns
+    query = query.order_by(columns.date, columns.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def generate():
+        # The request-scoped session may be closed before streaming finishes,
+        # so the export holds its own session for the lifetime of the cursor
+        with Session(engine) as session:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if format == "csv":
+                writer.writerow(REPORT_COLUMNS)
+                yield buffer.getvalue()
+
+            for batch in session.exec(query).partitions():
+                buffer.seek(0)
+                buffer.truncate()
+                for r in batch:
+                    row = _report_row(r)
+                    if format == "csv":
+                        writer.writerow([row[column] for column in REPORT_COLUMNS])
+                    else:
+                        buffer.write(json.dumps(row) + "\n")
+                yield buffer.getvalue()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"attendance_export_{dt_date.today().strftime('%Y%m%d')}.{format}"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,46 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File, Request, Response, Query, WebSocketException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import timedelta, datetime
-from typing import Annotated
+from typing import Annotated, Optional
 import shutil
 from pathlib import Path
 import os
 import time
 
-from database import get_session
+from database import engine, get_async_session, get_session
 from models import User, Organization, TeacherInvite
 from schemas import Token, OrganizationRegister, OrganizationResponse
 from auth_utils import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, generate_invite_token
 from jose import JWTError, jwt
 from auth_utils import SECRET_KEY, ALGORITHM
 from org_utils import generate_org_code, send_org_code_email
+from cache_utils import bump, check_not_modified
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _claims_from_token(token: str):
+    """(username, org_code) from a token; usernames are only unique within an org."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        org_code: str = payload.get("org_code")
+        if username is None or org_code is None:
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
-        
-    statement = select(User).where(User.username == username)
-    user = session.exec(statement).first()
+        raise _credentials_exception()
+    return username, org_code
+
+def _user_statement(token: str):
+    username, org_code = _claims_from_token(token)
+    return select(User).where(User.username == username, User.org_code == org_code)
+
+def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+    user = session.exec(_user_statement(token)).first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    return user
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """get_current_user for `async def` routes; shares the route's async session."""
+    user = (await session.exec(_user_statement(token))).first()
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+def get_current_user_for_stream(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    access_token: Optional[str] = Query(None)
+):
+    """
+    Auth for long-lived streams. Browsers' EventSource/WebSocket cannot set
+    headers, so the token may also come as ?access_token=. Uses its own
+    short session so no pooled connection is held for the stream's lifetime.
+    """
+    with Session(engine) as session:
+        user = get_current_user(token or access_token or "", session)
+        session.expunge(user)
     return user
 
+def get_current_user_for_websocket(access_token: Optional[str] = Query(None)):
+    """WebSocket auth from ?access_token=; a bad token closes the socket with 1008."""
+    try:
+        return get_current_user_for_stream(None, access_token)
+    except HTTPException:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+
 @router.post("/token", response_model=Token)
-async def login_for_access_token(
+def login_for_access_token(
     org_code: str = Form(...),
     username: str = Form(...),
     password: str = Form(...),
@@ -122,10 +166,19 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/users/me")
-async def read_users_me(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+async def read_users_me(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user_async),
+    session: AsyncSession = Depends(get_async_session)
+):
     """Get current user with organization info"""
+    not_modified = check_not_modified(request, response, ("users",), current_user.org_code, current_user.id)
+    if not_modified:
+        return not_modified
+
     org_statement = select(Organization).where(Organization.org_code == current_user.org_code)
-    organization = session.exec(org_statement).first()
+    organization = (await session.exec(org_statement)).first()
     
     return {
         "username": current_user.username,
@@ -137,7 +190,7 @@ async def read_users_me(current_user: User = Depends(get_current_user), session:
     }
 
 @router.post("/users/me/profile-picture")
-async def upload_profile_picture(
+def upload_profile_picture(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
@@ -159,7 +212,7 @@ async def upload_profile_picture(
         print(f"[OK] File type validated: {file.content_type}")
         
         # Validate file size (2MB max)
-        contents = await file.read()
+        contents = file.file.read()
         file_size = len(contents)
         print(f"File size: {file_size} bytes ({file_size / 1024:.2f} KB)")
         
@@ -190,6 +243,7 @@ async def upload_profile_picture(
         current_user.profile_picture_url = f"/uploads/{unique_filename}"
         session.add(current_user)
         session.commit()
+        bump("users", current_user.org_code)
         session.refresh(current_user)
         print(f"[OK] Database updated")
         print(f"Old URL: {old_profile_pic}")
@@ -328,7 +382,7 @@ def register_user(
 # ============================================================================
 
 @router.get("/admin/organizations", include_in_schema=False)
-async def list_all_organizations(
+def list_all_organizations(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
@@ -356,7 +410,7 @@ async def list_all_organizations(
     } for org in organizations]
 
 @router.get("/admin/users", include_in_schema=False)
-async def list_all_users(
+def list_all_users(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
@@ -397,7 +451,7 @@ async def list_all_users(
 # ============================================================================
 
 @router.post("/admin/create-teacher-invite")
-async def create_teacher_invite(
+def create_teacher_invite(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
@@ -431,7 +485,7 @@ async def create_teacher_invite(
     }
 
 @router.get("/admin/teacher-invites")
-async def list_teacher_invites(
+def list_teacher_invites(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
@@ -459,7 +513,7 @@ async def list_teacher_invites(
     } for invite in invites]
 
 @router.delete("/admin/teacher-invites/{token}")
-async def revoke_teacher_invite(
+def revoke_teacher_invite(
     token: str,
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
@@ -486,7 +540,7 @@ async def revoke_teacher_invite(
     return {"message": "Invite revoked successfully"}
 
 @router.get("/verify-teacher-invite/{token}")
-async def verify_teacher_invite(
+def verify_teacher_invite(
     token: str,
     session: Session = Depends(get_session)
 ):
@@ -518,7 +572,7 @@ async def verify_teacher_invite(
     }
 
 @router.post("/register-teacher-via-invite")
-async def register_teacher_via_invite(
+def register_teacher_via_invite(
     token: str = Form(...),
     name: str = Form(...),
     username: str = Form(...),
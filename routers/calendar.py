@@ -0,0 +1,202 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from typing import Optional
+from datetime import date as dt_date
+
+from database import engine, get_session
+from models import Holiday, User
+from schemas import HolidayCreate
+from routers.auth import get_current_user
+from cache_utils import bump, check_not_modified
+from holiday_utils import add_working_days, get_calendar, invalidate
+from streak_utils import rebuild_absence_streaks
+
+router = APIRouter()
+
+# Most working days /next-working-day looks ahead
+MAX_WORKING_DAYS_AHEAD = 1000
+
+
+def _calendar(org_code, *days, session: Session):
+    try:
+        return get_calendar(org_code, *days, session=session)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _require_admin(current_user: User):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+def _recount_streaks(org_code):
+    """Absence streaks skip holidays, so they are recounted after the calendar changes."""
+    with Session(engine) as session:
+        rebuild_absence_streaks(session, org_code)
+
+
+def _holidays_changed(org_code, background_tasks: BackgroundTasks):
+    invalidate(org_code)
+    bump("holidays", org_code)
+    background_tasks.add_task(_recount_streaks, org_code)
+
+
+@router.get("/holidays")
+def list_holidays(
+    request: Request,
+    response: Response,
+    year: Optional[int] = Query(None, ge=1900, le=2200),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Holidays of a calendar year (default: this year): the shared list plus
+    the organization's own (`shared` tells them apart).
+    Supports conditional GET (ETag / If-None-Match).
+    """
+    year = year or dt_date.today().year
+    not_modified = check_not_modified(request, response, ("holidays",), current_user.org_code, "list", year)
+    if not_modified:
+        return not_modified
+
+    holidays = session.exec(
+        select(Holiday).where(
+            or_(Holiday.org_code == current_user.org_code, Holiday.org_code.is_(None)),
+            Holiday.date >= dt_date(year, 1, 1),
+            Holiday.date <= dt_date(year, 12, 31)
+        )
+        .order_by(Holiday.date, Holiday.id)
+    ).all()
+    return [
+        {
+            "id": h.id,
+            "date": str(h.date),
+            "name": h.name,
+            "holiday_type": h.holiday_type,
+            "shared": h.org_code is None
+        }
+        for h in holidays
+    ]
+
+
+@router.post("/holidays", status_code=201)
+def create_holiday(
+    holiday: HolidayCreate,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Add a holiday for the organization (admin only)."""
+    _require_admin(current_user)
+    existing = session.exec(
+        select(Holiday).where(Holiday.org_code == current_user.org_code, Holiday.date == holiday.date)
+    ).first()
+    if existing:
+        raise HTTPException(status_code=409, detail=f"{holiday.date} is already a holiday ({existing.name})")
+
+    db_holiday = Holiday(org_code=current_user.org_code, **holiday.model_dump())
+    session.add(db_holiday)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Lost a race with another create of the same date
+        session.rollback()
+        raise HTTPException(status_code=409, detail=f"{holiday.date} is already a holiday")
+    session.refresh(db_holiday)
+    _holidays_changed(current_user.org_code, background_tasks)
+    return {
+        "id": db_holiday.id,
+        "date": str(db_holiday.date),
+        "name": db_holiday.name,
+        "holiday_type": db_holiday.holiday_type,
+        "shared": False
+    }
+
+
+@router.delete("/holidays/{holiday_id}")
+def delete_holiday(
+    holiday_id: int,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Remove one of the organization's own holidays (admin only)."""
+    _require_admin(current_user)
+    holiday = session.exec(
+        select(Holiday).where(Holiday.id == holiday_id, Holiday.org_code == current_user.org_code)
+    ).first()
+    if not holiday:
+        raise HTTPException(status_code=404, detail="Holiday not found")
+
+    session.delete(holiday)
+    session.commit()
+    _holidays_changed(current_user.org_code, background_tasks)
+    return {"message": "Holiday deleted", "id": holiday_id}
+
+
+@router.get("/working-day")
+def get_working_day(
+    request: Request,
+    response: Response,
+    date: dt_date,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Whether `date` is a working day for the organization, and the holiday name if any."""
+    not_modified = check_not_modified(request, response, ("holidays",), current_user.org_code, "day", date)
+    if not_modified:
+        return not_modified
+
+    calendar = _calendar(current_user.org_code, date, session=session)
+    return {
+        "date": str(date),
+        "working_day": calendar.is_working_day(date),
+        "holiday": calendar.holidays.get(date)
+    }
+
+
+@router.get("/working-days")
+def get_working_days(
+    request: Request,
+    response: Response,
+    start_date: dt_date,
+    end_date: dt_date,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Number of working days from `start_date` to `end_date`, both included."""
+    not_modified = check_not_modified(
+        request, response, ("holidays",), current_user.org_code, "count", start_date, end_date
+    )
+    if not_modified:
+        return not_modified
+
+    calendar = _calendar(current_user.org_code, start_date, end_date, session=session)
+    return {
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "working_days": calendar.count_working_days(start_date, end_date)
+    }
+
+
+@router.get("/next-working-day")
+def get_next_working_day(
+    request: Request,
+    response: Response,
+    date: dt_date,
+    n: int = Query(1, ge=1, le=MAX_WORKING_DAYS_AHEAD),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """The `n`-th working day after `date` (n=1: the next one)."""
+    not_modified = check_not_modified(request, response, ("holidays",), current_user.org_code, "next", date, n)
+    if not_modified:
+        return not_modified
+
+    try:
+        next_day = add_working_days(current_user.org_code, date, n, session)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"date": str(date), "n": n, "working_day": str(next_day)}
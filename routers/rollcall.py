@@ -0,0 +1,198 @@
+"""
+Live roll call over WebSocket.
+
+One in-memory session exists per (org, class, division, subject, date).
+Every teacher connected to it sees each toggle as it happens; toggles are
+buffered and written to the Attendance table in batched group commits
+(every ROLLCALL_FLUSH_INTERVAL seconds, sooner once ROLLCALL_FLUSH_BATCH
+marks are pending, and when the last teacher leaves).
+
+Client -> server: {"type": "mark", "student_id": "...", "status": "P"|"A"|"L"}
+                  {"type": "flush"}   (write pending marks now, e.g. on "Done")
+Server -> client: {"type": "snapshot", "students": [...], "marks": {...}}
+                  {"type": "mark", "student_id": ..., "status": ..., "by": username}
+                  {"type": "flushed", "count": n}
+                  {"type": "error", "detail": "..."}
+"""
+
+import asyncio
+import json
+from datetime import date as dt_date
+
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, WebSocketException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+
+from database import engine
+from models import Attendance, User
+from routers.auth import get_current_user_for_websocket
+from archive_utils import is_archived_date
+from analytics_utils import get_roster
+from streak_utils import update_absence_streaks
+from attendance_utils import (
+    VALID_STATUSES, notify_write, subject_id_of, update_daily_rollup, update_student_totals, upsert_attendance
+)
+
+router = APIRouter()
+
+# Seconds between group commits, and pending marks that trigger an early one
+ROLLCALL_FLUSH_INTERVAL = 2.0
+ROLLCALL_FLUSH_BATCH = 50
+
+# Open sessions keyed by (org_code, class_name, division, subject, date)
+_sessions: dict = {}
+
+
+def _load_roll(org_code, class_name, division, subject, day):
+    """Return (students, marks) for a session from the database."""
+    with Session(engine) as session:
+        students = get_roster(session, org_code, class_name, division)
+        codes = {s.id: s.student_id for s in students}
+        marks = {
+            codes[student_pk]: status
+            for student_pk, status in session.exec(
+                select(Attendance.student_pk, Attendance.status).where(
+                    Attendance.org_code == org_code,
+                    Attendance.subject_id == subject_id_of(org_code, subject),
+                    Attendance.date == day,
+                    Attendance.student_pk.in_(codes)
+                )
+            )
+        } if codes else {}
+    roster = [{"student_id": s.student_id, "name": s.name, "roll_no": s.roll_no} for s in students]
+    return roster, marks
+
+
+def _write_marks(org_code, subject, day, marks, student_classes):
+    """Group commit of buffered marks; returns the number of rows written."""
+    with Session(engine) as session:
+        written = upsert_attendance(session, org_code, subject, day, marks)
+        update_daily_rollup(session, org_code, subject, day, written, student_classes)
+        update_student_totals(session, subject, day, written)
+        update_absence_streaks(session, org_code, subject, day, written)
+        session.commit()
+    notify_write(org_code)
+    return len(written)
+
+
+class RollCallSession:
+    def __init__(self, key, roster, marks):
+        self.key = key
+        self.org_code, self.class_name, self.division, self.subject, self.date = key
+        self.roster = roster
+        self.student_classes = {s["student_id"]: (self.class_name, self.division) for s in roster}
+        self.marks = marks      # Current state as every client sees it
+        self.pending = {}       # Marks not yet written
+        self.sockets = set()
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def broadcast(self, message):
+        for websocket in list(self.sockets):
+            try:
+                await websocket.send_json(message)
+            except Exception:
+                self.sockets.discard(websocket)  # Its own handler cleans up
+
+    async def mark(self, student_id, status_code, username):
+        self.marks[student_id] = status_code
+        self.pending[student_id] = status_code
+        await self.broadcast({"type": "mark", "student_id": student_id, "status": status_code, "by": username})
+        if len(self.pending) >= ROLLCALL_FLUSH_BATCH:
+            self._wake.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            try:
+                count = await run_in_threadpool(
+                    _write_marks, self.org_code, self.subject, self.date, batch, self.student_classes
+                )
+            except Exception as e:
+                print(f"[RollCall] Flush failed for {self.key}: {e}")
+                # Keep the marks for the next attempt unless they were toggled again meanwhile
+                self.pending = {**batch, **self.pending}
+                await self.broadcast({"type": "error", "detail": "Could not save attendance, retrying"})
+                return
+            await self.broadcast({"type": "flushed", "count": count})
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), ROLLCALL_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def leave(self, websocket):
+        self.sockets.discard(websocket)
+        if self.sockets:
+            return
+        await self.flush()
+        # Someone may have joined while the last marks were being written
+        if not self.sockets and _sessions.get(self.key) is self:
+            del _sessions[self.key]
+            self._flusher.cancel()
+            await self.flush()  # Anything marked after the cancel point
+
+
+async def _join(key, websocket):
+    roll = _sessions.get(key)
+    if roll is None:
+        org_code, class_name, division, subject, day = key
+        roster, marks = await run_in_threadpool(_load_roll, org_code, class_name, division, subject, day)
+        # Another teacher may have opened it while the roll was loading
+        roll = _sessions.get(key)
+        if roll is None:
+            roll = _sessions[key] = RollCallSession(key, roster, marks)
+    roll.sockets.add(websocket)
+    return roll
+
+
+@router.websocket("/rollcall")
+async def roll_call(
+    websocket: WebSocket,
+    class_name: str,
+    subject: str,
+    date: dt_date,
+    division: str = "A",
+    current_user: User = Depends(get_current_user_for_websocket)
+):
+    """
+    Join the live roll call for a class, division, subject and date.
+    Authenticate with ?access_token=. See the module docstring for messages.
+    """
+    if is_archived_date(date):
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="This academic year has been archived")
+
+    await websocket.accept()
+    key = (current_user.org_code, class_name, division, subject, date)
+    roll = await _join(key, websocket)
+    try:
+        await websocket.send_json({"type": "snapshot", "students": roll.roster, "marks": roll.marks})
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                message = None
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "mark":
+                student_id, status_code = message.get("student_id"), message.get("status")
+                if student_id not in roll.student_classes:
+                    await websocket.send_json({"type": "error", "detail": f"Unknown student {student_id}"})
+                elif status_code not in VALID_STATUSES:
+                    await websocket.send_json({"type": "error", "detail": "Status must be one of P, A, L"})
+                else:
+                    await roll.mark(student_id, status_code, current_user.username)
+            elif kind == "flush":
+                await roll.flush()
+            else:
+                await websocket.send_json({"type": "error", "detail": "Unknown message type"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await roll.leave(websocket)
@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 
-from database import get_session
+from database import get_async_session, get_session
 from models import Student, User
 from schemas import StudentCreate, StudentRead, ClassSeedRequest
-from routers.auth import get_current_user
+from routers.auth import get_current_user, get_current_user_async
+from cache_utils import bump, check_not_modified
 
 router = APIRouter()
 
@@ -23,21 +26,29 @@ SEED_NAMES = [
 
 
 @router.get("/", response_model=List[StudentRead])
-def read_students(
+async def read_students(
+    request: Request,
+    response: Response,
     class_name: Optional[str] = None,
     division: Optional[str] = None,
     offset: int = 0,
     limit: int = 100,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user_async)
 ):
-    query = select(Student)
+    not_modified = check_not_modified(
+        request, response, ("students",), current_user.org_code, class_name, division, offset, limit
+    )
+    if not_modified:
+        return not_modified
+
+    query = select(Student).where(Student.org_code == current_user.org_code)
     if class_name:
         query = query.where(Student.class_name == class_name)
     if division:
         query = query.where(Student.division == division)
-    query = query.offset(offset).limit(limit)
-    students = session.exec(query).all()
+    query = query.order_by(Student.class_name, Student.division, Student.roll_no).offset(offset).limit(limit)
+    students = (await session.exec(query)).all()
     return students
 
 
@@ -54,13 +65,21 @@ def create_student(
         import time
         student.student_id = f"STU{int(time.time())}"
 
+    # Student IDs are unique across all orgs
     existing = session.exec(select(Student).where(Student.student_id == student.student_id)).first()
     if existing:
         raise HTTPException(status_code=400, detail=f"Student ID '{student.student_id}' already exists")
 
     db_student = Student.from_orm(student)
+    db_student.org_code = current_user.org_code
     session.add(db_student)
-    session.commit()
+    try:
+        session.commit()
+    except IntegrityError:
+        # Lost a race with another create of the same ID
+        session.rollback()
+        raise HTTPException(status_code=409, detail=f"Student ID '{student.student_id}' already exists")
+    bump("students", current_user.org_code)
     session.refresh(db_student)
     return db_student
 
@@ -80,29 +99,47 @@ def seed_class_students(
     class_name = seed_req.class_name.strip().upper()
     division = seed_req.division.strip().upper()
 
-    # Remove existing students for this class+division to avoid duplicates
-    existing = session.exec(
-        select(Student).where(Student.class_name == class_name, Student.division == division)
-    ).all()
-    for s in existing:
-        session.delete(s)
-    session.commit()
+    # Reseeding updates the class's existing students in place, by roll
+    # number: attendance refers to students by row id, so re-creating them
+    # would orphan it
+    existing = {
+        s.roll_no: s
+        for s in session.exec(
+            select(Student).where(
+                Student.org_code == current_user.org_code,
+                Student.class_name == class_name,
+                Student.division == division
+            )
+        ).all()
+    }
 
     created = []
     for i, name in enumerate(SEED_NAMES, start=1):
-        prefix = f"{class_name}{division}"
-        student_id = f"{prefix}{i:03d}"
-        db_student = Student(
-            student_id=student_id,
-            name=name,
-            class_name=class_name,
-            division=division,
-            roll_no=i
+        # Student IDs are unique across all orgs, so new ones carry the org code
+        db_student = existing.pop(i, None) or Student(
+            org_code=current_user.org_code,
+            student_id=f"{current_user.org_code}-{class_name}{division}{i:03d}"
         )
+        db_student.name = name
+        db_student.class_name = class_name
+        db_student.division = division
+        db_student.roll_no = i
         session.add(db_student)
         created.append(db_student)
 
-    session.commit()
+    # Other students of the class are removed, to avoid duplicates
+    for s in existing.values():
+        session.delete(s)
+
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"Seeding {class_name}-{division} conflicts with existing students (student IDs are unique across organizations)"
+        )
+    bump("students", current_user.org_code)
     for s in created:
         session.refresh(s)
 
@@ -116,7 +153,7 @@ def read_student(
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    statement = select(Student).where(Student.student_id == student_id)
+    statement = select(Student).where(Student.org_code == current_user.org_code, Student.student_id == student_id)
     student = session.exec(statement).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
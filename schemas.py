@@ -1,7 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import date
-from models import Student, Attendance
+from datetime import date, datetime
+from models import Student
 
 class Token(BaseModel):
     access_token: str
@@ -27,8 +27,16 @@ class AttendanceCreate(BaseModel):
     date: date
     status: str = "P"  # "P", "A", "L"
 
-class AttendanceRead(Attendance):
-    pass
+class AttendanceRead(BaseModel):
+    """An attendance row with the student and subject by name, as the API returns it."""
+    id: int
+    org_code: Optional[str] = None
+    student_id: str
+    subject: str
+    date: date
+    status: str
+    revision: int = 0
+    updated_at: Optional[datetime] = None
 
 class BulkAttendanceItem(BaseModel):
     student_id: str
@@ -41,6 +49,17 @@ class BulkAttendanceCreate(BaseModel):
     date: date
     items: List[BulkAttendanceItem]
 
+class SyncMark(BaseModel):
+    student_id: str
+    subject: str
+    date: date
+    status: str = "P"
+    marked_at: datetime  # When the mark was taken on the device (last writer wins)
+
+class SyncRequest(BaseModel):
+    device_id: Optional[str] = None
+    marks: List[SyncMark]
+
 class ClassSeedRequest(BaseModel):
     class_name: str
     division: str = "A"
@@ -60,3 +79,8 @@ class OrganizationResponse(BaseModel):
     email: str
     admin_username: str
     message: str
+
+class HolidayCreate(BaseModel):
+    date: date
+    name: str
+    holiday_type: str = "gazetted"  # 'national' or 'gazetted'
@@ -0,0 +1,196 @@
+"""
+Consecutive-absence streaks, maintained on write.
+
+A student's streak in a subject counts the subject's marks in date order:
+an absence extends it, a present or late mark ends it. The all-subjects
+row (subject "*") does the same over days, where a day counts as absent
+when every mark of that day is "A". Marks on the org's non-working days
+(weekends, holidays; see holiday_utils.py) are skipped, so a Friday and
+the following Monday are consecutive.
+
+Marks appended after the latest counted day, the usual roll call, update
+the rows in place. Corrections and back-dated marks recompute the affected
+rows from the student's attendance.
+"""
+
+from collections import defaultdict
+from itertools import groupby
+
+from sqlalchemy import delete, update
+from sqlmodel import Session, select
+
+from models import AbsenceStreak, Student, Subject
+from archive_utils import attendance_source
+from attendance_utils import dialect_insert
+from holiday_utils import get_calendar, is_working_day
+
+# Subject of the per-student row counting whole days absent
+ALL_SUBJECTS = "*"
+
+
+def _advance(streak: AbsenceStreak, day, absent):
+    """Count one more day (after `streak.last_date`) into the streak."""
+    if absent:
+        streak.current += 1
+        if streak.current == 1:
+            streak.current_start = day
+        if streak.current > streak.longest:
+            streak.longest, streak.longest_end = streak.current, day
+    else:
+        streak.current, streak.current_start = 0, None
+    streak.last_date = day
+
+
+def _reset(streak: AbsenceStreak, days):
+    """Recount the streak from `days`: sorted (date, absent) pairs."""
+    streak.current = streak.longest = 0
+    streak.current_start = streak.longest_end = streak.last_date = None
+    for day, absent in days:
+        _advance(streak, day, absent)
+
+
+def _absent_days(marks, calendar):
+    """Sorted (date, absent) working days from (date, status) marks; a day is absent if every mark is."""
+    days = defaultdict(lambda: True)
+    for day, status in marks:
+        if calendar.is_working_day(day):
+            days[day] = days[day] and status == "A"
+    return sorted(days.items())
+
+
+def _calendar_for(session: Session, org_code, marks):
+    """The org's working-day calendar covering every date in `marks`."""
+    dates = [day for day, _ in marks]
+    return get_calendar(org_code, min(dates), max(dates), session=session) if dates else None
+
+
+def _lock_streaks(session: Session, org_code, student_ids, subject):
+    """
+    Return {(student_id, subject): AbsenceStreak} for the students' `subject`
+    and all-subjects rows, creating missing ones. Rows are locked FOR UPDATE
+    so concurrent writers for the same student apply in turn. The returned
+    objects are detached copies; _save_streaks writes them back.
+    """
+    keys = [(student_id, s) for student_id in student_ids for s in (subject, ALL_SUBJECTS)]
+    session.exec(
+        dialect_insert(session, AbsenceStreak)
+        .values([{"org_code": org_code, "student_id": student_id, "subject": s} for student_id, s in keys])
+        .on_conflict_do_nothing(index_elements=["student_id", "subject"])
+    )
+    table = AbsenceStreak.__table__
+    rows = session.exec(
+        select(*table.c)
+        .where(table.c.student_id.in_(student_ids), table.c.subject.in_((subject, ALL_SUBJECTS)))
+        .with_for_update()
+    ).all()
+    return {(row.student_id, row.subject): AbsenceStreak(**row._mapping) for row in rows}
+
+
+def _save_streaks(session: Session, streaks):
+    """Write detached AbsenceStreak rows back in one executemany UPDATE."""
+    session.execute(update(AbsenceStreak), [
+        {"id": s.id, "current": s.current, "longest": s.longest, "current_start": s.current_start,
+         "longest_end": s.longest_end, "last_date": s.last_date}
+        for s in streaks
+    ])
+
+
+def update_absence_streaks(session: Session, org_code, subject, date, written):
+    """
+    Apply the marks in `written` ((student_id, status, prev_status) tuples)
+    for `subject` on `date` to the students' streaks.
+    Does not commit; the caller owns the transaction.
+    """
+    changed = [(student_id, status, prev_status) for student_id, status, prev_status in written
+               if status != prev_status]
+    if not changed or not is_working_day(org_code, date, session):
+        return
+
+    streaks = _lock_streaks(session, org_code, {student_id for student_id, _, _ in changed}, subject)
+    recount = set()
+    for student_id, status, prev_status in changed:
+        absent = status == "A"
+        subject_key, day_key = (student_id, subject), (student_id, ALL_SUBJECTS)
+        if prev_status is not None:
+            # A corrected mark can split or join runs anywhere
+            recount.update((subject_key, day_key))
+            continue
+
+        by_subject = streaks[subject_key]
+        if by_subject.last_date is None or date > by_subject.last_date:
+            _advance(by_subject, date, absent)
+        else:
+            recount.add(subject_key)
+
+        by_day = streaks[day_key]
+        if day_key in recount:
+            continue
+        if by_day.last_date is None or date > by_day.last_date:
+            _advance(by_day, date, absent)
+        elif date == by_day.last_date:
+            # Another subject on the latest day: a present mark turns an absent day present
+            if not absent and by_day.current > 0:
+                if by_day.longest_end == date and by_day.longest == by_day.current:
+                    # The record was set today (longest only grows on a strictly longer run)
+                    by_day.longest, by_day.longest_end = by_day.current - 1, None
+                by_day.current, by_day.current_start = 0, None
+        else:
+            recount.add(day_key)
+
+    if recount:
+        recount_streaks(session, [streaks[key] for key in recount])
+    _save_streaks(session, streaks.values())
+
+
+def recount_streaks(session: Session, streaks):
+    """Recompute the given AbsenceStreak rows from their students' attendance."""
+    student_ids = {streak.student_id for streak in streaks}
+    source = attendance_source().c
+    marks = defaultdict(list)
+    for student_id, subject, day, status in session.exec(
+        select(Student.student_id, Subject.name, source.date, source.status)
+        .join(Student, Student.id == source.student_pk)
+        .join(Subject, Subject.id == source.subject_id)
+        .where(Student.student_id.in_(student_ids))
+    ):
+        marks[(student_id, subject)].append((day, status))
+        marks[(student_id, ALL_SUBJECTS)].append((day, status))
+    for streak in streaks:
+        streak_marks = marks[(streak.student_id, streak.subject)]
+        _reset(streak, _absent_days(streak_marks, _calendar_for(session, streak.org_code, streak_marks)))
+
+
+def rebuild_absence_streaks(session: Session, org_code=None):
+    """
+    Regenerate the streak rows of `org_code` (default: every org) from raw
+    attendance rows, archived academic years included. Commits and returns
+    the number of streak rows.
+    """
+    source = attendance_source().c
+    marks_query = (
+        select(source.org_code, Student.student_id, Subject.name, source.date, source.status)
+        .join(Student, Student.id == source.student_pk)
+        .join(Subject, Subject.id == source.subject_id)
+    )
+    if org_code:
+        session.exec(delete(AbsenceStreak).where(AbsenceStreak.org_code == org_code))
+        marks_query = marks_query.where(source.org_code == org_code)
+    else:
+        session.exec(delete(AbsenceStreak))
+
+    count = 0
+    rows = session.exec(marks_query.order_by(source.student_pk).execution_options(yield_per=1000))
+    for student_id, student_rows in groupby(rows, key=lambda row: row.student_id):
+        marks = defaultdict(list)
+        for student_org_code, _, subject, day, status in student_rows:
+            marks[subject].append((day, status))
+            marks[ALL_SUBJECTS].append((day, status))
+        calendar = _calendar_for(session, student_org_code, marks[ALL_SUBJECTS])
+        for subject, subject_marks in marks.items():
+            streak = AbsenceStreak(org_code=student_org_code, student_id=student_id, subject=subject)
+            _reset(streak, _absent_days(subject_marks, calendar))
+            session.add(streak)
+            count += 1
+    session.commit()
+
+    return count
@@ -0,0 +1,103 @@
+"""
+Concurrency stress test for POST /attendance/.
+
+Logs in, then fires many simultaneous marks at one (student, subject, date)
+key - two teachers or a double-click, many times over - and checks that
+exactly one attendance row survives for the key. Each round uses a fresh
+subject so the first writes race on the insert, not just the update.
+Run it against a server (one worker: the app keeps per-process state such
+as ETag versions, see DEPLOYMENT.md; the requests still race in its
+connection pool):
+
+    uvicorn main:app --port 8000 --workers 1 > /dev/null
+    python test_concurrent_marks.py --base-url http://127.0.0.1:8000
+
+Marks are written with subjects named "Stress-<run>-<round>"; run it against
+a throwaway database. Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import date
+
+import httpx
+
+
+async def login(client, org_code, username, password):
+    response = await client.post(
+        "/token", data={"org_code": org_code, "username": username, "password": password}
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def first_student_id(client, headers):
+    response = await client.get("/students/", headers=headers)
+    response.raise_for_status()
+    students = response.json()
+    if not students:
+        sys.exit("No students in this organization; add one or pass --student-id")
+    return students[0]["student_id"]
+
+
+async def run_round(client, headers, student_id, subject, day, parallel):
+    """Fire `parallel` marks at one key at once; return (status codes, rows for the key)."""
+    payloads = [
+        {"student_id": student_id, "subject": subject, "date": str(day), "status": "PAL"[i % 3]}
+        for i in range(parallel)
+    ]
+    responses = await asyncio.gather(
+        *(client.post("/attendance/", json=payload, headers=headers) for payload in payloads),
+        return_exceptions=True
+    )
+    codes = [r.status_code if isinstance(r, httpx.Response) else type(r).__name__ for r in responses]
+
+    response = await client.get(f"/attendance/student/{student_id}", headers=headers)
+    response.raise_for_status()
+    rows = [r for r in response.json() if r["subject"] == subject and r["date"] == str(day)]
+    return codes, rows
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.parallel, max_keepalive_connections=args.parallel)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        token = await login(client, args.org_code, args.username, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+        student_id = args.student_id or await first_student_id(client, headers)
+        run = int(time.time())
+
+        print("=" * 60)
+        print(f"{args.rounds} rounds of {args.parallel} parallel marks for {student_id} on {args.date}")
+        print("=" * 60)
+        failures = 0
+        for round_no in range(1, args.rounds + 1):
+            subject = f"Stress-{run}-{round_no}"
+            codes, rows = await run_round(client, headers, student_id, subject, args.date, args.parallel)
+            errors = [code for code in codes if code != 200]
+            ok = len(rows) == 1 and not errors
+            failures += not ok
+            detail = f"{len(rows)} row(s)"
+            if errors:
+                detail += f", {len(errors)} failed request(s): {sorted(set(map(str, errors)))}"
+            print(f"[{'OK' if ok else 'FAIL'}] round {round_no}: {detail}")
+
+        print("=" * 60)
+        if failures:
+            print(f"FAILED: {failures} of {args.rounds} rounds did not leave exactly one row")
+            sys.exit(1)
+        print("PASSED: every round left exactly one row")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel marks at one attendance key")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--org-code", default="SCH-DEMOIN-ABC123")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--student-id", help="Default: the organization's first student")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--parallel", type=int, default=20, help="Simultaneous marks per round")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,213 @@
+"""
+Optional write-behind mode for single-record attendance marks.
+
+With ATTENDANCE_WRITE_BEHIND=1, `POST /attendance/` appends the mark to a
+journal file and a bounded in-memory queue, then returns 202. A background
+thread drains the queue every WRITE_BEHIND_INTERVAL_MS, or as soon as
+WRITE_BEHIND_BATCH marks are waiting, and applies each batch in a single
+transaction through upsert_attendance. While a batch keeps failing, new
+marks stay in the queue; once it is full the route answers 503.
+
+The journal is rotated into a segment for every batch and the segment is
+deleted once the batch commits. Segments left over from a crash are replayed
+by the first flush after startup. Marks carry the time they were queued and are applied
+last-writer-wins, so replaying an already-applied segment is harmless.
+"""
+
+import glob
+import json
+import os
+import queue
+import threading
+from collections import defaultdict
+from datetime import date as dt_date, datetime
+
+from sqlmodel import Session
+
+from database import engine
+from attendance_utils import (
+    get_student_classes, notify_write, update_daily_rollup, update_student_totals, upsert_attendance
+)
+from streak_utils import update_absence_streaks
+
+ENABLED = os.getenv("ATTENDANCE_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+FLUSH_INTERVAL = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50")) / 1000
+FLUSH_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+# fsync every queued mark (survives power loss, not just a process crash)
+FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "0").lower() in ("1", "true", "yes")
+JOURNAL_DIR = os.getenv("WRITE_BEHIND_DIR", "journal")
+
+JOURNAL_PATH = os.path.join(JOURNAL_DIR, "marks.journal")
+
+
+class QueueFull(Exception):
+    """Raised when the write-behind queue is at capacity; the client should retry later."""
+
+
+_queue = queue.Queue(maxsize=MAX_QUEUE)
+_lock = threading.Lock()      # Orders journal appends with queue puts and rotations
+_wake = threading.Event()
+_stop = threading.Event()
+_journal = None
+_segment_counter = 0
+_flusher = None
+
+
+def _open_journal():
+    global _journal
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    _journal = open(JOURNAL_PATH, "a", encoding="utf-8")
+
+
+def enqueue(org_code, student_id, subject, day, status):
+    """Journal and queue one mark. Raises QueueFull when back-pressure applies."""
+    mark = {
+        "org_code": org_code, "student_id": student_id, "subject": subject,
+        "date": day.isoformat(), "status": status, "marked_at": datetime.utcnow().isoformat()
+    }
+    with _lock:
+        if _queue.full():
+            raise QueueFull()
+        _journal.write(json.dumps(mark) + "\n")
+        _journal.flush()
+        if FSYNC:
+            os.fsync(_journal.fileno())
+        _queue.put_nowait(mark)
+        size = _queue.qsize()
+    if size >= FLUSH_BATCH:
+        _wake.set()
+
+
+def _segment_path():
+    global _segment_counter
+    _segment_counter += 1
+    return f"{JOURNAL_PATH}.{datetime.utcnow():%Y%m%d%H%M%S%f}.{_segment_counter:06d}"
+
+
+def _rotate():
+    """Drain the queue and move its journal lines into a segment; returns (segment, marks)."""
+    with _lock:
+        marks = []
+        while True:
+            try:
+                marks.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not marks:
+            return None
+        _journal.close()
+        segment = _segment_path()
+        os.replace(JOURNAL_PATH, segment)
+        _open_journal()
+    return segment, marks
+
+
+def apply_marks(marks):
+    """
+    Apply queued marks in one transaction, last writer wins per
+    (student, subject, date). Returns the number of rows written.
+    """
+    groups = defaultdict(dict)
+    for mark in marks:
+        key = (mark["org_code"], mark["subject"], dt_date.fromisoformat(mark["date"]))
+        marked_at = datetime.fromisoformat(mark["marked_at"])
+        previous = groups[key].get(mark["student_id"])
+        if previous is None or previous[1] <= marked_at:
+            groups[key][mark["student_id"]] = (mark["status"], marked_at)
+
+    applied = 0
+    with Session(engine) as session:
+        student_classes = get_student_classes(
+            session, {student_id for group in groups.values() for student_id in group}
+        )
+        for (org_code, subject, day), group in groups.items():
+            written = upsert_attendance(
+                session, org_code, subject, day,
+                {student_id: status for student_id, (status, _) in group.items()},
+                marked_at={student_id: marked_at for student_id, (_, marked_at) in group.items()},
+                only_newer=True
+            )
+            update_daily_rollup(session, org_code, subject, day, written, student_classes)
+            update_student_totals(session, subject, day, written)
+            update_absence_streaks(session, org_code, subject, day, written)
+            applied += len(written)
+        session.commit()
+
+    for org_code in {org_code for org_code, _, _ in groups}:
+        notify_write(org_code)
+    return applied
+
+
+def _read_segment(path):
+    with open(path, encoding="utf-8") as f:
+        # A crash mid-append can leave a truncated last line
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+def _flush(pending):
+    """Apply every pending batch in one transaction; returns False if it failed."""
+    batch = [mark for _, marks in pending for mark in marks]
+    try:
+        applied = apply_marks(batch)
+    except Exception as e:
+        print(f"[WriteBehind] Flush of {len(batch)} marks failed, will retry: {e}")
+        return False
+    for segment, _ in pending:
+        os.remove(segment)
+    pending.clear()
+    if len(batch) >= FLUSH_BATCH:
+        print(f"[WriteBehind] Applied {len(batch)} queued marks ({applied} rows written)")
+    return True
+
+
+def _flush_loop(pending):
+    """pending: (segment, marks) batches not committed yet, retried oldest first."""
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        stopping = _stop.is_set()
+
+        # The queue is only drained once earlier batches are applied: while
+        # they keep failing it fills up and enqueue() pushes back with QueueFull
+        if pending and not _flush(pending):
+            if stopping:
+                return
+            continue
+        rotated = _rotate()
+        if rotated:
+            pending.append(rotated)
+            _flush(pending)
+        if stopping:
+            return
+
+
+def start():
+    """
+    Start the background flusher. Segments left by a previous process are
+    applied by its first flush; their marks are older than anything written
+    since, so last-writer-wins keeps newer marks.
+    """
+    global _flusher
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    if os.path.exists(JOURNAL_PATH):
+        os.replace(JOURNAL_PATH, _segment_path())
+    pending = [(path, _read_segment(path)) for path in sorted(glob.glob(JOURNAL_PATH + ".*"))]
+    if pending:
+        print(f"[WriteBehind] Replaying {sum(len(marks) for _, marks in pending)} journaled marks")
+    _open_journal()
+    _stop.clear()
+    _flusher = threading.Thread(target=_flush_loop, args=(pending,), name="write-behind", daemon=True)
+    _flusher.start()
+    print(f"[WriteBehind] Enabled: every {FLUSH_INTERVAL * 1000:.0f} ms or {FLUSH_BATCH} marks, "
+          f"queue limit {MAX_QUEUE}")
+
+
+def stop():
+    """Flush what is queued and stop the flusher (called on shutdown)."""
+    if _flusher is None:
+        return
+    _stop.set()
+    _wake.set()
+    _flusher.join(timeout=30)
+    _journal.close()